@@ -33,150 +33,71 @@ dunky_attributes = {
     "sprite": "sprites/dunky"
 }
 
-def fireball(char1, char2):
-    """Deal 25+str magic damage, costs 10 mana"""
-    dmg_for = 25 + char1.strength
-    if char1.mana >= 10:
-        if char2.defend_stance == 1:
-            damage = dmg_for // 2
-        else:
-            damage = dmg_for
-
-        p = char2.take_damage(damage)
-        char1.mana -= 10
-        char1.play_sound("fireball")
-        if p == 1:
-            char2.play_sound("parry")
-            char2.start_animation("parry")
-            char2.total_m_dam += damage
-            return "Parried"
-        else:
-            char1.total_damage_dealt += damage
-
-            return f"{char1.name} casts Fireball for {damage} damage!"
-    return "Not enough mana for Fireball!"
-
-def smoke(char1, char2):
-    """Deal 10+str damage"""
-    dmg_for = 10 + char1.strength
-    if char1.mana >= 10:
-        if char2.defend_stance == 1:
-            damage = dmg_for // 2
-        else:
-            damage = dmg_for
-
-        p = char2.take_damage(damage)
-        char1.mana -= 10
-        char1.play_sound("smoke")
-        if p == 1:
-            char2.play_sound("parry")
-            char2.start_animation("parry")
-            char2.total_m_dam += damage
-            return "Parried"
-        else:
-            char1.total_damage_dealt += damage
-            return f"{char1.name} casts Smoke for {damage} damage!"
-    return "Not enough mana for Smoke!"
-
-def heal(char1, char2):
-    """Heals 30 HP"""
-    if char1.mana >= 5:
-        heal_amount = 30
-        if char1.health + heal_amount > char1.max_health:
-            heal_amount = char1.max_health - char1.health
-            char1.health = char1.max_health
-        else:
-            char1.health = char1.health + heal_amount
-        char1.mana -= 5
-        char1.total_healing_done += heal_amount
-        return f"{char1.name} heals for {heal_amount} HP!"
-    return "Not enough mana for Heal!"
-
-def bash(char1, char2):
-    """Deal 15+str Damages"""
-    dmg_for = (15 + char1.strength)
-    if char2.defend_stance == 1:
-        damage = dmg_for//2
-    else:
-        damage = dmg_for
-    char2.health -= damage
-    char1.total_damage_dealt += damage
-    return f"{char1.name} bashes {char2.name} for {damage} damage!"
-
-def shield(char1, char2):
-    """+10 def"""
-    char1.defense += 10
-    return f"{char1.name} shields, increasing defense by 10!"
-
-def swipe(char1, char2):
-    """Basic attack: 10 + str damage"""
-    dmg_for = 10 + char2.strength
-    if char2.defend_stance == 1:
-        damage = dmg_for // 2
-    else:
-        damage = dmg_for
-
-    p = char2.take_damage(damage)
-    char1.play_sound("swipe")
-    char2.start_animation("attack")
-    if p == 1:
-        char2.play_sound("parry")
-        char2.start_animation("parry")
-        char2.total_m_dam += damage
-        return "Parried"
-    else:
-        char1.total_damage_dealt += damage
-        return f"{char1.name} casts Swipe for {damage} damage!"
-
-def kick(char1, char2):
-    """Stronger attack: 15 + str damage"""
-    dmg_for = 15 + char2.strength
-    if char2.defend_stance == 1:
-        damage = dmg_for // 2
-    else:
-        damage = dmg_for
-
-    p = char2.take_damage(damage)
-    char1.play_sound("swipe")
-    char2.start_animation("attack")
-    if p == 1:
-        char2.play_sound("parry")
-        char2.start_animation("parry")
-        char2.total_m_dam += damage
-        return "Parried"
-    else:
-        char1.total_damage_dealt += damage
-        return f"{char1.name} kicks for {damage} damage!"
-def potion(char1, char2):
-    """Heals 20 HP"""
-    heal_amount = 20
-    if char1.health + heal_amount > char1.max_health:
-        heal_amount = char1.max_health - char1.health
-        char1.health = char1.max_health
-    else:
-        char1.health = char1.health + heal_amount
-    char1.total_healing_done += heal_amount
-    return f"{char1.name} uses a potion to restore {heal_amount} HP!"
-
-def elixir(char1, char2):
-    """Heals 30 MP"""
-    char1.mana = min(char1.max_mana, char1.mana + 30)
-    return f"{char1.name} uses an elixir to restore 30 mana!"
-
-
-ability_effects = {
-    "Fireball": fireball,
-    "Heal": heal,
-    "Bash": bash,
-    "Shield": shield,
-    "Swipe": swipe,
-    "Kick": kick,
-    "Smoke": smoke
+# Abilities and items are plain data; effects.py compiles them into the functions
+# Character calls and batch_sim.py into vectorized ones, so a new ability is a new
+# entry here. Per kind:
+#   damage   amount + the scaling character's strength ("attacker", "target" or None),
+#            halved when the target defends and halved_by_defend is set; parryable
+#            moves go through take_damage (which halves a defended hit again and
+#            ends the stance), the others through take_unparryable, which does neither
+#   heal     restores up to amount hp
+#   mana     restores up to amount mana
+#   defense  adds amount to defense
+# cost is mana, checked before the move and paid after it. sound plays when the
+# effect lands; animation, status_effect (on the target) and self_status_effect play
+# after the move, target_animation on the target as it is hit. description is the
+# button caption in the battle HUD.
+ability_specs = {
+    "Fireball": {
+        "description": "Deal 25+str magic damage, costs 10 mana",
+        "kind": "damage", "amount": 25, "scaling": "attacker", "cost": 10,
+        "sound": "fireball", "animation": "attack", "status_effect": "fireball",
+        "message": "{name} casts Fireball for {amount} damage!"
+    },
+    "Heal": {
+        "description": "Heals 30 HP",
+        "kind": "heal", "amount": 30, "cost": 5, "self_status_effect": "heal",
+        "message": "{name} heals for {amount} HP!"
+    },
+    "Bash": {
+        "description": "Deal 15+str Damages",
+        "kind": "damage", "amount": 15, "scaling": "attacker", "parryable": False,
+        "message": "{name} bashes {target} for {amount} damage!"
+    },
+    "Shield": {
+        "description": "+10 def",
+        "kind": "defense", "amount": 10,
+        "message": "{name} shields, increasing defense by {amount}!"
+    },
+    "Swipe": {
+        "description": "Basic attack: 10 + str damage",
+        "kind": "damage", "amount": 10, "scaling": "target",
+        "sound": "swipe", "target_animation": "attack",
+        "message": "{name} casts Swipe for {amount} damage!"
+    },
+    "Kick": {
+        "description": "Stronger attack: 15 + str damage",
+        "kind": "damage", "amount": 15, "scaling": "target",
+        "sound": "swipe", "target_animation": "attack",
+        "message": "{name} kicks for {amount} damage!"
+    },
+    "Smoke": {
+        "description": "Deal 10+str damage",
+        "kind": "damage", "amount": 10, "scaling": "attacker", "cost": 10,
+        "sound": "smoke", "animation": "attack", "status_effect": "smoke",
+        "message": "{name} casts Smoke for {amount} damage!"
+    }
 }
 
-item_effects = {
-    "Potion": potion,
-    "Elixir": elixir
+item_specs = {
+    "Potion": {
+        "description": "Heals 20 HP",
+        "kind": "heal", "amount": 20,
+        "message": "{name} uses a potion to restore {amount} HP!"
+    },
+    "Elixir": {
+        "description": "Heals 30 MP",
+        "kind": "mana", "amount": 30,
+        "message": "{name} uses an elixir to restore {amount} mana!"
+    }
 }
-
-
@@ -0,0 +1,252 @@
+import sys
+import time
+import numpy as np
+import attribute as atr
+from battle_engine import Battle, Character
+
+# Move codes for one side: 0 attack, 1 defend, 2.. abilities, then items, -1 is the
+# empty branch of Character.take_turn (nothing happens, the turn still passes).
+ATTACK = 0
+DEFEND = 1
+NO_MOVE = -1
+
+
+class BatchSide:
+    def __init__(self, attr, n):
+        self.name = attr["name"]
+        self.abilities = list(attr["abilities"])
+        self.items = list(attr["items"])
+        self.health = np.full(n, attr["health"], dtype=np.int32)
+        self.max_health = np.full(n, attr["health"], dtype=np.int32)
+        self.mana = np.full(n, attr["mana"], dtype=np.int32)
+        self.max_mana = np.full(n, attr["mana"], dtype=np.int32)
+        self.strength = np.full(n, attr["strength"], dtype=np.int32)
+        self.defense = np.full(n, attr["defense"], dtype=np.int32)
+        self.defend_stance = np.zeros(n, dtype=np.int32)
+        self.total_damage_dealt = np.zeros(n, dtype=np.int32)
+        self.total_healing_done = np.zeros(n, dtype=np.int32)
+        self.total_m_dam = np.zeros(n, dtype=np.int32)
+
+    def moves(self):
+        return ([("attack", None), ("defend", None)]
+                + [("ability", name) for name in self.abilities]
+                + [("item", name) for name in self.items])
+
+    def random_codes(self, rng, n):
+        move_type = rng.integers(0, 4, n)
+        codes = move_type.astype(np.int16)
+        ability = move_type == 2
+        item = move_type == 3
+        if self.abilities:
+            codes[ability] = 2 + rng.integers(0, len(self.abilities), int(ability.sum()))
+        else:
+            codes[ability] = NO_MOVE
+        if self.items:
+            codes[item] = 2 + len(self.abilities) + rng.integers(0, len(self.items), int(item.sum()))
+        else:
+            codes[item] = NO_MOVE
+        return codes
+
+
+# Every effect gets the integer indices of the battles that picked it this turn, so a
+# turn only touches the battles still running instead of masking all n of them.
+def _halved_by_stance(target, damage, idx):
+    return np.where(target.defend_stance[idx] == 1, damage // 2, damage)
+
+
+def _take_damage(target, damage, idx):
+    # no parry in the batch: nobody is there to click
+    target.health[idx] -= _halved_by_stance(target, damage, idx)
+    target.defend_stance[idx] = 0
+
+
+def _restore_health(char1, idx, amount):
+    heal_amount = np.minimum(amount, char1.max_health[idx] - char1.health[idx])
+    char1.health[idx] += heal_amount
+    char1.total_healing_done[idx] += heal_amount
+
+
+def attack(char1, char2, idx):
+    damage = _halved_by_stance(char2, np.maximum(1, char1.strength[idx] - char2.defense[idx] // 5), idx)
+    _take_damage(char2, damage, idx)
+    char1.total_damage_dealt[idx] += damage
+
+
+def defend(char1, char2, idx):
+    char1.defend_stance[idx] = 1
+
+
+# The attribute.py specs effects.py compiles for battle_engine, compiled again into
+# vectorized effects; only the numbers matter here, the presentation hooks do not.
+def compile_damage(spec):
+    cost = spec.get("cost", 0)
+    scaling = spec.get("scaling")
+    halved = spec.get("halved_by_defend", True)
+    parryable = spec.get("parryable", True)
+
+    def effect(char1, char2, idx):
+        if cost:
+            idx = idx[char1.mana[idx] >= cost]
+        damage = spec["amount"]
+        if scaling is not None:
+            damage = damage + (char1 if scaling == "attacker" else char2).strength[idx]
+        if halved:
+            damage = _halved_by_stance(char2, damage, idx)
+        if parryable:
+            _take_damage(char2, damage, idx)
+        else:
+            char2.health[idx] -= damage
+        char1.mana[idx] -= cost
+        char1.total_damage_dealt[idx] += damage
+    return effect
+
+
+def compile_heal(spec):
+    cost = spec.get("cost", 0)
+
+    def effect(char1, char2, idx):
+        if cost:
+            idx = idx[char1.mana[idx] >= cost]
+        _restore_health(char1, idx, spec["amount"])
+        char1.mana[idx] -= cost
+    return effect
+
+
+def compile_mana(spec):
+    def effect(char1, char2, idx):
+        char1.mana[idx] = np.minimum(char1.max_mana[idx], char1.mana[idx] + spec["amount"])
+    return effect
+
+
+def compile_defense(spec):
+    def effect(char1, char2, idx):
+        char1.defense[idx] += spec["amount"]
+    return effect
+
+
+COMPILERS = {
+    "damage": compile_damage,
+    "heal": compile_heal,
+    "mana": compile_mana,
+    "defense": compile_defense
+}
+
+ability_effects = {name: COMPILERS[spec["kind"]](spec) for name, spec in atr.ability_specs.items()}
+item_effects = {name: COMPILERS[spec["kind"]](spec) for name, spec in atr.item_specs.items()}
+
+
+class BatchBattle:
+    def __init__(self, hero_attr, enemy_attr, n, max_turns=500):
+        self.n = n
+        self.max_turns = max_turns
+        self.sides = [BatchSide(hero_attr, n), BatchSide(enemy_attr, n)]
+        self.active = np.ones(n, dtype=bool)
+        self.turns = np.zeros(n, dtype=np.int32)
+        # 0 hero won, 1 enemy won, -1 still running or drawn at max_turns
+        self.winner = np.full(n, -1, dtype=np.int8)
+        self.effects = [self._effect_table(side) for side in self.sides]
+
+    def _effect_table(self, side):
+        table = [attack, defend]
+        table += [ability_effects[name] for name in side.abilities]
+        table += [item_effects[name] for name in side.items]
+        return table
+
+    def apply(self, side_index, codes, idx):
+        actor = self.sides[side_index]
+        target = self.sides[1 - side_index]
+        for code, effect in enumerate(self.effects[side_index]):
+            chosen = idx[codes == code]
+            if len(chosen):
+                effect(actor, target, chosen)
+
+    def check_win(self, idx):
+        hero, enemy = self.sides
+        hero_dead = idx[hero.health[idx] <= 0]
+        self.winner[hero_dead] = 1
+        self.active[hero_dead] = False
+        idx = idx[self.active[idx]]
+        enemy_dead = idx[enemy.health[idx] <= 0]
+        self.winner[enemy_dead] = 0
+        self.active[enemy_dead] = False
+        return idx[self.active[idx]]
+
+    def run(self, rng, record=None):
+        idx = np.flatnonzero(self.active)
+        turn = 0
+        while len(idx) and turn < self.max_turns:
+            for side_index, side in enumerate(self.sides):
+                codes = side.random_codes(rng, len(idx))
+                if record is not None:
+                    full = np.full(self.n, NO_MOVE, dtype=np.int16)
+                    full[idx] = codes
+                    record.append(full)
+                if side_index == 0:
+                    self.turns[idx] += 1
+                self.apply(side_index, codes, idx)
+                idx = self.check_win(idx)
+            turn += 1
+        return self
+
+    def win_rate(self):
+        return float((self.winner == 0).mean())
+
+
+def replay_scalar(hero_attr, enemy_attr, hero_codes, enemy_codes, max_turns=500):
+    """Plays one battle through battle_engine with the move codes the batch drew."""
+    battle = Battle(Character(hero_attr), Character(enemy_attr))
+    hero, enemy = battle.character1, battle.character2
+    hero_moves = BatchSide(hero_attr, 0).moves()
+    enemy_moves = BatchSide(enemy_attr, 0).moves()
+    for hero_code, enemy_code in zip(hero_codes, enemy_codes):
+        if battle.game_over or battle.turns >= max_turns:
+            break
+        battle.turns += 1
+        if hero_code != NO_MOVE:
+            hero.perform(hero_moves[hero_code], enemy)
+        battle.check_win()
+        if not battle.game_over and enemy_code != NO_MOVE:
+            enemy.perform(enemy_moves[enemy_code], hero)
+            battle.check_win()
+    return battle
+
+
+def parity_check(hero_attr, enemy_attr, n=1000, seed=0, max_turns=500):
+    record = []
+    batch = BatchBattle(hero_attr, enemy_attr, n, max_turns).run(np.random.default_rng(seed), record)
+    hero_codes = np.array(record[0::2])
+    enemy_codes = np.array(record[1::2])
+    fields = ["health", "mana", "defense", "defend_stance",
+              "total_damage_dealt", "total_healing_done", "total_m_dam"]
+    mismatches = []
+    for i in range(n):
+        battle = replay_scalar(hero_attr, enemy_attr, hero_codes[:, i], enemy_codes[:, i], max_turns)
+        winner = battle.winner()
+        expected_winner = -1 if winner is None else (0 if winner is battle.character1 else 1)
+        if expected_winner != batch.winner[i] or battle.turns != batch.turns[i]:
+            mismatches.append((i, "winner/turns"))
+        for side, char in zip(batch.sides, (battle.character1, battle.character2)):
+            for field in fields:
+                if getattr(side, field)[i] != getattr(char, field):
+                    mismatches.append((i, f"{char.name}.{field}"))
+    return mismatches
+
+
+if __name__ == "__main__":
+    if "--parity" in sys.argv:
+        failed = False
+        for enemy in (atr.visor_attributes, atr.dunky_attributes):
+            mismatches = parity_check(atr.meepo_attributes, enemy)
+            print(f"Meepo vs {enemy['name']}: {len(mismatches)} mismatches", mismatches[:5])
+            failed = failed or bool(mismatches)
+        sys.exit(1 if failed else 0)
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    rng = np.random.default_rng(0)
+    for enemy in (atr.visor_attributes, atr.dunky_attributes):
+        start = time.perf_counter()
+        batch = BatchBattle(atr.meepo_attributes, enemy, count).run(rng)
+        elapsed = time.perf_counter() - start
+        print(f"Meepo vs {enemy['name']}: {count} battles in {elapsed:.2f}s "
+              f"({count / elapsed:.0f} battles/s), win rate {batch.win_rate():.3f}, "
+              f"avg turns {batch.turns.mean():.1f}")
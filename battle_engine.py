@@ -0,0 +1,532 @@
+import argparse
+import os
+import random
+import time
+import sys
+import attribute as atr
+import combat_log
+import effects
+from event_log import START, ACTION, DAMAGE, PARRY, END
+
+
+class BattleObserver:
+    """Presentation hook. The rules core never draws or plays audio itself, it only
+    tells its observers what happened; subclasses override whatever they care about."""
+
+    def on_sound(self, character, name):
+        pass
+
+    def on_animation(self, character, name):
+        pass
+
+    def on_status_effect(self, character, name):
+        pass
+
+
+MOVE_TYPES = ("attack", "defend", "ability", "item")
+# how long the enemy waits before it moves, so the hero's move can play out on screen
+ENEMY_TURN_DELAY_MS = 1000
+
+
+def default_clock():
+    return int(time.monotonic() * 1000)
+
+
+class Character:
+    # Combat state only. Sprites, sounds and animation timers live in the observers
+    # (combat_turn_based.CharacterSprite keeps a reference to its Character), so a
+    # Character stays a fixed, small record that is cheap to clone, snapshot and restore.
+    __slots__ = ("name", "max_health", "max_mana", "strength", "abilities", "items",
+                 "health", "mana", "defense", "defend_stance",
+                 "total_m_dam", "total_damage_dealt", "total_healing_done",
+                 "moveset", "battle", "observers")
+
+    def __init__(self, attr):
+        self.name = attr["name"]
+        self.health = attr["health"]
+        self.max_health = attr["health"]
+        self.mana = attr["mana"]
+        self.max_mana = attr["mana"]
+        self.strength = attr["strength"]
+        self.defense = attr["defense"]
+        self.abilities = attr["abilities"]
+        self.items = attr["items"]
+        self.moveset = []
+
+        self.total_m_dam = 0
+        self.total_damage_dealt = 0
+        self.total_healing_done = 0
+        self.defend_stance = 0
+        self.battle = None
+        self.observers = ()
+
+    def attach(self, observer):
+        self.observers += (observer,)
+
+    def play_sound(self, action):
+        for observer in self.observers:
+            observer.on_sound(self, action)
+
+    def start_animation(self, animation):
+        for observer in self.observers:
+            observer.on_animation(self, animation)
+
+    def show_status_effect(self, animation):
+        for observer in self.observers:
+            observer.on_status_effect(self, animation)
+
+    def attack(self, target):
+        damage = max(1, self.strength - target.defense // 5)
+        if target.defend_stance == 1:
+            damage //= 2
+        p = target.take_damage(damage)
+        shown = self.observers or target.observers
+        if p == 1:
+            if shown:
+                target.play_sound("parry")
+                target.start_animation("parry")
+            target.total_m_dam += damage
+            target.moveset.append("parry")
+            return "Parried"
+        else:
+            self.total_damage_dealt += damage
+            if shown:
+                self.play_sound("attack")
+                self.start_animation("attack")
+            self.moveset.append("attack")
+            return f"{self.name} attacks for {damage} damage!"
+
+    def defend(self, target=None):
+        self.defend_stance = 1
+        if self.observers:
+            self.play_sound("defend")
+        self.moveset.append("defend")
+        return f"{self.name} defends!"
+
+    def use_ability(self, ability, target):
+        resolve = effects.abilities.get(ability)
+        if resolve is None:
+            return "Invalid ability!"
+        return resolve(self, target)
+
+    def use_item(self, item, target):
+        resolve = effects.items.get(item)
+        if resolve is None:
+            return "Invalid item!"
+        return resolve(self, target)
+
+    def take_damage(self, amount):
+        battle = self.battle
+        if battle is not None and battle.parry_success:
+            battle.parry_success = False
+            battle.parry_window = False
+            battle.action_message = "Parry! No damage taken!"
+            battle.record_event(PARRY, self, amount=battle.clock() - battle.parry_timer)
+            return 1
+
+        if self.defend_stance == 1:
+            lost = amount // 2
+            self.defend_stance = 0
+        else:
+            lost = amount
+        self.health -= lost
+        if battle is not None and battle.events is not None:
+            battle.record_event(DAMAGE, self, amount=lost)
+
+    def take_unparryable(self, amount):
+        # no parry and no halving, and the defend stance stays up
+        self.health -= amount
+        battle = self.battle
+        if battle is not None and battle.events is not None:
+            battle.record_event(DAMAGE, self, amount=amount)
+
+    def choose_move(self, rng=random):
+        move_type = rng.choice(MOVE_TYPES)
+        if move_type == "attack" or move_type == "defend":
+            return move_type, None
+        elif move_type == "ability" and self.abilities:
+            return move_type, rng.choice(self.abilities)
+        elif move_type == "item" and self.items:
+            return move_type, rng.choice(self.items)
+        return None
+
+    def perform(self, move, opponent):
+        if move is None:
+            return None
+        resolve = MOVES.get(move)
+        if resolve is not None:
+            return resolve(self, opponent)
+        move_type, choice = move
+        if move_type == "ability":
+            return self.use_ability(choice, opponent)
+        elif move_type == "item":
+            return self.use_item(choice, opponent)
+
+    def take_turn(self, opponent, rng=random):
+        return self.perform(self.choose_move(rng), opponent)
+
+    def legal_moves(self):
+        return ([("attack", None), ("defend", None)] + [("ability", name) for name in self.abilities]
+                + [("item", name) for name in self.items])
+
+    def clone(self):
+        """A detached copy to look ahead with: same stats, empty moveset, no battle or observers."""
+        copy = Character.__new__(Character)
+        copy.name = self.name
+        copy.max_health = self.max_health
+        copy.max_mana = self.max_mana
+        copy.strength = self.strength
+        copy.abilities = self.abilities
+        copy.items = self.items
+        copy.health = self.health
+        copy.mana = self.mana
+        copy.defense = self.defense
+        copy.defend_stance = self.defend_stance
+        copy.total_m_dam = self.total_m_dam
+        copy.total_damage_dealt = self.total_damage_dealt
+        copy.total_healing_done = self.total_healing_done
+        copy.moveset = []
+        copy.battle = None
+        copy.observers = ()
+        return copy
+
+    def snapshot(self):
+        """Everything a move can change, as a flat tuple for restore(); the moveset is
+        kept as its length, since moves only ever append to it."""
+        return (self.health, self.mana, self.defense, self.defend_stance, self.total_m_dam,
+                self.total_damage_dealt, self.total_healing_done, len(self.moveset))
+
+    def restore(self, snapshot):
+        (self.health, self.mana, self.defense, self.defend_stance, self.total_m_dam,
+         self.total_damage_dealt, self.total_healing_done, moves) = snapshot
+        del self.moveset[moves:]
+
+
+class RandomPolicy:
+    """The original enemy: a uniformly random move type, then a random ability or item.
+
+    An enemy policy only has to provide choose(actor, opponent, rng). Policies with
+    background set also provide submit(thinker, actor, opponent, rng), which starts
+    the choice on the battle's thinker and returns a future of the move, so it can be
+    worked out while the enemy turn delay runs.
+    """
+    name = "random"
+    background = False
+
+    def choose(self, actor, opponent, rng=random):
+        return actor.choose_move(rng)
+
+
+RANDOM_POLICY = RandomPolicy()
+
+
+# Every move choose_move can pick, straight to the function that resolves it
+MOVES = {("attack", None): Character.attack, ("defend", None): Character.defend}
+MOVES.update({("ability", name): resolve for name, resolve in effects.abilities.items()})
+MOVES.update({("item", name): resolve for name, resolve in effects.items.items()})
+
+
+class Battle:
+    __slots__ = ("character1", "character2", "clock", "rng", "log_file", "is_character1_turn", "game_over",
+                 "action_message", "show_abilities", "show_items", "battle_report", "waiting_for_enemy",
+                 "enemy_turn_time", "turns", "enemy_policy", "thinker", "enemy_move", "events", "event_id",
+                 "started_at", "parry_window", "parry_success", "parry_timer", "seed", "inputs")
+
+    def __init__(self, character1, character2, clock=default_clock, rng=None, log_file=None, events=None,
+                 enemy_policy=None, thinker=None, seed=None, record=False):
+        self.character1 = character1
+        self.character2 = character2
+        character1.battle = self
+        character2.battle = self
+        self.clock = clock
+        # Without an rng of its own the battle draws from random.Random(seed), a fresh
+        # seed when none is given, so a recorded battle can be played again (see replay.py)
+        if rng is None:
+            self.seed = random.randrange(1 << 32) if seed is None else seed
+            rng = random.Random(self.seed)
+        else:
+            self.seed = None
+        self.rng = rng
+        # With record, every input that can change the outcome is kept in order as
+        # [tick, kind, ...]: hero actions, parry window edges, parries and enemy moves
+        self.inputs = [] if record else None
+        self.log_file = log_file
+        self.is_character1_turn = True
+        self.game_over = False
+        self.action_message = "Choose your action!"
+        self.show_abilities = False
+        self.show_items = False
+        self.battle_report = ""
+        self.waiting_for_enemy = False
+        self.enemy_turn_time = None
+        self.turns = 0
+
+        # How character2 picks its moves. A background policy is started on thinker (a
+        # concurrent.futures executor, e.g. enemy_ai.process_thinker) as soon as the hero
+        # has moved, so it can think through the enemy turn delay without holding up
+        # whoever calls update().
+        self.enemy_policy = enemy_policy or RANDOM_POLICY
+        self.thinker = thinker
+        self.enemy_move = None
+
+        # Per-turn event stream (an event_log.EventLog), off when None
+        self.events = events
+        self.event_id = events.begin_battle() if events is not None else 0
+        self.started_at = clock()
+        self.record_event(START, character1)
+
+        # Parry mechanic
+        self.parry_window = False
+        self.parry_success = False
+        self.parry_timer = 0
+
+    def opponent_of(self, character):
+        return self.character2 if character is self.character1 else self.character1
+
+    def record_event(self, kind, actor, move=None, amount=0):
+        if self.events is not None:
+            self.events.emit(self.event_id, self.clock() - self.started_at, self.turns, kind,
+                             actor, self.opponent_of(actor), move, amount)
+
+    def record_input(self, kind, *args):
+        if self.inputs is not None:
+            self.inputs.append([self.clock(), kind, *args])
+
+    def open_parry_window(self):
+        self.record_input("open")
+        self.parry_window = True
+        self.parry_timer = self.clock()
+
+    def close_parry_window(self):
+        self.record_input("close")
+        self.parry_window = False
+
+    def try_parry(self):
+        if self.parry_window:
+            self.record_input("parry")
+            self.parry_success = True
+            return True
+        return False
+
+    def process_action(self, action, ability_choice=None, item_choice=None):
+        if self.game_over or not self.is_character1_turn:
+            return
+        self.record_input("action", action, ability_choice, item_choice)
+
+        if action == "attack":
+            self.action_message = self.character1.attack(self.character2)
+        elif action == "defend":
+            self.action_message = self.character1.defend()
+        elif action == "item":
+            if item_choice:
+                self.action_message = self.character1.use_item(item_choice, self.character2)
+                self.show_items = False
+            else:
+                self.show_items = not self.show_items
+                return
+        elif action == "ability":
+            if ability_choice:
+                self.action_message = self.character1.use_ability(ability_choice, self.character2)
+                self.show_abilities = False
+            else:
+                self.show_abilities = not self.show_abilities
+                return
+
+        self.record_event(ACTION, self.character1,
+                          ability_choice if action == "ability" else item_choice if action == "item" else action)
+        self.turns += 1
+        self.is_character1_turn = False
+        self.waiting_for_enemy = True
+        self.enemy_turn_time = self.clock() + ENEMY_TURN_DELAY_MS
+        self.check_win()
+        if not self.game_over and self.thinker is not None and self.enemy_policy.background:
+            self.enemy_move = self.enemy_policy.submit(self.thinker, self.character2.clone(),
+                                                       self.character1.clone(), self.rng)
+
+    def next_enemy_move(self):
+        if self.enemy_move is not None:
+            move = self.enemy_move.result()
+            self.enemy_move = None
+            return move
+        return self.enemy_policy.choose(self.character2, self.character1, self.rng)
+
+    def resolve_enemy_turn(self):
+        if not self.game_over:
+            move = self.next_enemy_move()
+            self.record_input("enemy", *(move or (None, None)))
+            self.action_message = f"{self.character2.perform(move, self.character1)}"
+            self.record_event(ACTION, self.character2, move and (move[1] or move[0]))
+            self.check_win()
+        self.is_character1_turn = True
+        self.waiting_for_enemy = False
+
+    def update(self):
+        if self.waiting_for_enemy and self.clock() >= self.enemy_turn_time:
+            if self.enemy_move is not None and not self.enemy_move.done():
+                return  # still thinking; the frame goes on
+            self.resolve_enemy_turn()
+
+    def check_win(self):
+        if self.character1.health <= 0:
+            self.action_message = "You lose!"
+            self.game_over = True
+        elif self.character2.health <= 0:
+            self.action_message = "You win!"
+            self.game_over = True
+        else:
+            return
+        self.battle_report = self.generate_combat_report()
+        battle_id = -1
+        if self.log_file:
+            battle_id = self.save_combat_report(self.log_file)
+        self.record_event(END, self.character1, self.result_code(self.character1), battle_id)
+
+    def winner(self):
+        if not self.game_over:
+            return None
+        return self.character2 if self.character1.health <= 0 else self.character1
+
+    def generate_combat_report(self):
+        report = f"{self.character1.name} dealt {self.character1.total_damage_dealt} damage.\n"
+        report += f"{self.character1.name} healed {self.character1.total_healing_done} HP.\n"
+        report += f"{self.character1.name} mitigated {self.character1.total_m_dam} damage.\n"
+        report += f"{self.character2.name} dealt {self.character2.total_damage_dealt} damage.\n"
+        report += f"{self.character2.name} healed {self.character2.total_healing_done} HP.\n"
+        return report
+
+    def result_code(self, character):
+        winner = self.winner()
+        if winner is None:
+            return combat_log.DRAW
+        return combat_log.WIN if winner is character else combat_log.LOSS
+
+    def combat_log_entries(self):
+        entries = []
+        for side, (char, opponent) in enumerate([(self.character1, self.character2),
+                                                 (self.character2, self.character1)]):
+            entries.append({
+                "name": char.name,
+                "opponent": opponent.name,
+                "result": self.result_code(char),
+                "side": side,
+                "damage_dealt": char.total_damage_dealt,
+                "healing_done": char.total_healing_done,
+                "damage_mitigated": char.total_m_dam,
+                "moves": char.moveset
+            })
+        return entries
+
+    def save_combat_report(self, filename=combat_log.LOG_FILE):
+        return combat_log.append_battle(filename, self.combat_log_entries())
+
+
+def play_headless(battle, max_turns=500):
+    """Runs a battle to the end with both sides on the random policy, no delays."""
+    hero = battle.character1
+    while not battle.game_over and battle.turns < max_turns:
+        move = hero.choose_move(battle.rng)
+        if move is None:
+            # same as the enemy's empty branch: the turn passes with nothing done
+            battle.turns += 1
+            battle.is_character1_turn = False
+        else:
+            move_type, choice = move
+            battle.process_action(move_type,
+                                  ability_choice=choice if move_type == "ability" else None,
+                                  item_choice=choice if move_type == "item" else None)
+        battle.resolve_enemy_turn()
+    return battle
+
+
+def simulate_battle(hero_attr, enemy_attr, rng=None, max_turns=500, log_file=None, events=None, enemy_policy=None):
+    rng = rng or random.Random()
+    battle = Battle(Character(hero_attr), Character(enemy_attr), rng=rng, log_file=log_file, events=events,
+                    enemy_policy=enemy_policy)
+    return play_headless(battle, max_turns)
+
+
+def simulate_and_log(task):
+    """Process-pool task: plays count battles and appends them to log_file in batches."""
+    count, seed, log_file, batch = task
+    rng = random.Random(seed)
+    pending = []
+    for i in range(count):
+        enemy = atr.visor_attributes if i % 2 == 0 else atr.dunky_attributes
+        pending.append(simulate_battle(atr.meepo_attributes, enemy, rng).combat_log_entries())
+        if len(pending) >= batch:
+            combat_log.append_battles(log_file, pending)
+            pending = []
+    if pending:
+        combat_log.append_battles(log_file, pending)
+    return count
+
+
+def log_in_parallel(count, log_file, workers, batch=256):
+    from concurrent.futures import ProcessPoolExecutor
+    workers = workers or os.cpu_count() or 1
+    shares = [count // workers + (1 if i < count % workers else 0) for i in range(workers)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        done = sum(pool.map(simulate_and_log, [(share, i, log_file, batch) for i, share in enumerate(shares)]))
+    elapsed = time.perf_counter() - start
+    print(f"{done} battles from {workers} processes logged to {log_file} in {elapsed:.2f}s "
+          f"({done / elapsed:.0f} battles/s)")
+
+
+def clone_benchmark(count):
+    """clone() and snapshot()/restore() throughput, and the memory a fresh battle takes."""
+    import tracemalloc
+    hero, enemy = Character(atr.meepo_attributes), Character(atr.visor_attributes)
+    start = time.perf_counter()
+    for _ in range(count):
+        hero.clone()
+        enemy.clone()
+    clone_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(count):
+        hero_state, enemy_state = hero.snapshot(), enemy.snapshot()
+        hero.restore(hero_state)
+        enemy.restore(enemy_state)
+    restore_elapsed = time.perf_counter() - start
+    print(f"clone: {count / clone_elapsed:.0f} battle states/s, "
+          f"snapshot + restore: {count / restore_elapsed:.0f} battle states/s, "
+          f"snapshot {2 * sys.getsizeof(hero.snapshot())} bytes")
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    # sharing one rng like the simulators do; a seeded battle adds its own random.Random (~2.5 KiB)
+    rng = random.Random(0)
+    battles = [Battle(Character(atr.meepo_attributes), Character(atr.visor_attributes), rng=rng)
+               for _ in range(10000)]
+    per_battle = (tracemalloc.get_traced_memory()[0] - before) / len(battles)
+    tracemalloc.stop()
+    print(f"{per_battle:.0f} bytes per in-flight battle (Battle, both Characters and their lists)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless battle benchmark.")
+    parser.add_argument("count", type=int, nargs="?", default=10000)
+    parser.add_argument("--log", help="append every battle to this combat log from a process pool")
+    parser.add_argument("--workers", type=int, default=None, help="process count for --log, defaults to all cores")
+    parser.add_argument("--clone-bench", action="store_true",
+                        help="time count clones and snapshot/restores of a battle's two characters instead")
+    args = parser.parse_args()
+    if args.clone_bench:
+        clone_benchmark(args.count)
+        sys.exit(0)
+    if args.log:
+        log_in_parallel(args.count, args.log, args.workers)
+        sys.exit(0)
+
+    count = args.count
+    rng = random.Random(0)
+    wins = {}
+    start = time.perf_counter()
+    for i in range(count):
+        enemy = atr.visor_attributes if i % 2 == 0 else atr.dunky_attributes
+        winner = simulate_battle(atr.meepo_attributes, enemy, rng).winner()
+        key = winner.name if winner else "Draw"
+        wins[key] = wins.get(key, 0) + 1
+    elapsed = time.perf_counter() - start
+    print(f"{count} battles in {elapsed:.2f}s ({count / elapsed:.0f} battles/s)")
+    print(wins)
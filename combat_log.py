@@ -0,0 +1,457 @@
+import csv
+import ast
+import json
+import os
+import struct
+import sys
+import time
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Typed combat log. combat_log.bin is a 4 KiB JSON header followed by fixed 32-byte
+# records, one per character per battle; combat_log.moves holds every moveset as one
+# byte per move. A record points into the moves file with (moves_offset, moves_count)
+# and is only appended after its moves, so a record never points past the end.
+#
+# Against the CSV this is about 3x smaller, not 10x (python combat_log.py bench: 5.0 MB
+# vs 1.7 MB for 20000 battles, 250 vs 87 bytes per battle). The moves are where the CSV
+# spends its bytes, about 10 per move for the quoted name, and here they take one.
+# The rest is two 32-byte records per battle, and those cannot get much smaller while
+# every record carries its battle id, opponent, result, three totals and moves
+# offset/count. 20-byte records (16-bit totals, a 32-bit moves offset) and 4-bit moves
+# would still leave about 52 bytes per battle (under 5x), with totals a long battle can
+# overflow. Loading is where the order of magnitude is: mapping the records is over
+# 1000x faster than parsing the CSV.
+#
+# The header carries the name and move tables that the one-byte codes index into;
+# new names are appended, never reordered, so old records keep their meaning.
+#
+# Any number of processes may append at once: every append holds an exclusive lock on
+# a sidecar <log>.lock file for the whole battle batch, and a reader never trusts
+# more than the complete records it sees, so a writer killed mid-append only leaves a
+# torn tail that the next writer cuts off.
+#
+# Once the live log holds ROTATE_RECORDS records the next append moves it aside as a
+# segment, combat_log.<first battle id>.bin (+ .moves), and starts an empty live log
+# whose header keeps the name/move tables and records the first battle id it holds.
+# log_aggregates.compact_history folds segments into a summary snapshot.
+#
+# The old combat_log.csv is merged in by the first append to a log whose header does
+# not have "csv_migrated" set, so it is never lost to a log the game created first.
+
+LOG_FILE = "combat_log.bin"
+LEGACY_CSV = "combat_log.csv"
+MAGIC = b"SNCL"
+HEADER_SIZE = 4096
+RECORD_FORMAT = "<IBBBBiiiQI"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+DEFAULT_MOVES = ["attack", "defend", "parry", "item",
+                 "Fireball", "Heal", "Bash", "Shield", "Swipe", "Kick", "Smoke"]
+
+ROTATE_RECORDS = 1 << 20
+
+LOSS, WIN, DRAW, UNKNOWN = 0, 1, 2, 255
+RESULTS = {LOSS: "Loss", WIN: "Win", DRAW: "Draw", UNKNOWN: "Unknown"}
+
+
+def moves_path(path):
+    return os.path.splitext(path)[0] + ".moves"
+
+
+def segment_path(path, first_battle_id):
+    base, ext = os.path.splitext(path)
+    return f"{base}.{first_battle_id:010d}{ext}"
+
+
+def list_segments(path):
+    """Rotated segments of the log at path, oldest first, as (first battle id, segment path)."""
+    base, ext = os.path.splitext(path)
+    directory = os.path.dirname(path) or "."
+    prefix = os.path.basename(base) + "."
+    segments = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(ext):
+            first_id = name[len(prefix):len(name) - len(ext)]
+            if len(first_id) == 10 and first_id.isdigit():
+                segments.append((int(first_id), os.path.join(directory, name)))
+    return sorted(segments)
+
+
+def log_files(path):
+    """Every file still holding records of the log, oldest first: segments, then the live log."""
+    return [segment for _, segment in list_segments(path)] + [path]
+
+
+@contextmanager
+def locked(path):
+    """Holds an exclusive, cross-process lock on path for the duration of the block."""
+    with open(path + ".lock", "a+b") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def record_dtype():
+    import numpy as np
+    return np.dtype([
+        ("battle_id", "<u4"), ("name", "u1"), ("opponent", "u1"), ("result", "u1"), ("side", "u1"),
+        ("damage_dealt", "<i4"), ("healing_done", "<i4"), ("damage_mitigated", "<i4"),
+        ("moves_offset", "<u8"), ("moves_count", "<u4")
+    ])
+
+
+def new_header():
+    return {"version": 1, "names": [], "moves": list(DEFAULT_MOVES)}
+
+
+def read_header(path, magic=MAGIC):
+    with open(path, "rb") as file:
+        raw = file.read(HEADER_SIZE)
+    if not raw.startswith(magic):
+        raise ValueError(f"{path} is not a combat log")
+    return json.loads(raw[len(magic):].decode("utf-8"))
+
+
+def encode_header(header, magic=MAGIC):
+    body = magic + json.dumps(header, separators=(",", ":")).encode("utf-8")
+    if len(body) > HEADER_SIZE:
+        raise ValueError("combat log header is full")
+    return body.ljust(HEADER_SIZE, b" ")
+
+
+def code_for(table, value):
+    if value not in table:
+        if len(table) >= 255:
+            raise ValueError(f"no code left for {value!r}")
+        table.append(value)
+    return table.index(value)
+
+
+def record_count(path, record_size=RECORD_SIZE):
+    """Complete records after the header; also for files with other records (event_log)."""
+    if not os.path.exists(path):
+        return 0
+    return max(0, os.path.getsize(path) - HEADER_SIZE) // record_size
+
+
+def pack_battle(header, battle_id, moves_offset, entries):
+    """Encodes one battle; returns (record bytes, move bytes). May grow header tables."""
+    records = []
+    moves = bytearray()
+    for entry in entries:
+        codes = bytes(code_for(header["moves"], move) for move in entry["moves"])
+        records.append(struct.pack(
+            RECORD_FORMAT, battle_id,
+            code_for(header["names"], entry["name"]), code_for(header["names"], entry["opponent"]),
+            entry.get("result", UNKNOWN), entry.get("side", 0),
+            entry["damage_dealt"], entry["healing_done"], entry["damage_mitigated"],
+            moves_offset + len(moves), len(codes)))
+        moves += codes
+    return b"".join(records), bytes(moves)
+
+
+def snapshot(path):
+    """(header, complete record count), read together under the append lock."""
+    with locked(path):
+        return read_header(path), record_count(path)
+
+
+def rotate(path, header):
+    """Moves the live log aside as a segment and starts an empty one. Call under the lock."""
+    first_id = header.get("first_battle_id", 0)
+    next_id = first_id + record_count(path) // 2
+    segment = segment_path(path, first_id)
+    os.replace(path, segment)
+    if os.path.exists(moves_path(path)):
+        os.replace(moves_path(path), moves_path(segment))
+    header = dict(header, first_battle_id=next_id)
+    with open(path, "wb") as file:
+        file.write(encode_header(header))
+    return header
+
+
+def drop_incomplete(path):
+    """Truncates what a writer that died mid-append left behind: a torn record, and the
+    first record of a battle whose second one never made it. Call under the lock;
+    returns the record count, which is then even."""
+    count = record_count(path) // 2 * 2
+    if os.path.getsize(path) != HEADER_SIZE + count * RECORD_SIZE:
+        with open(path, "r+b") as file:
+            file.truncate(HEADER_SIZE + count * RECORD_SIZE)
+    return count
+
+
+def append_battles(path, battles, rotate_records=ROTATE_RECORDS):
+    """Appends battles (each a list of per-character entry dicts) and returns their ids.
+
+    The whole batch is written under the lock, so concurrent writers never interleave
+    inside a battle and ids stay unique.
+    """
+    with locked(path):
+        return _append_battles(path, battles, rotate_records)
+
+
+def _open_for_append(path, rotate_records=0):
+    """(header, record count) of the log, created if missing, with any torn tail cut off
+    and rotated if it is full. Call under the lock."""
+    if not os.path.exists(path):
+        header = new_header()
+        with open(path, "wb") as file:
+            file.write(encode_header(header))
+        return header, 0
+    header = read_header(path)
+    count = drop_incomplete(path)
+    if rotate_records and count >= rotate_records:
+        header = rotate(path, header)
+        count = 0
+    return header, count
+
+
+def _append_battles(path, battles, rotate_records):
+    header, count = _open_for_append(path, rotate_records)
+    if not header.get("csv_migrated"):
+        count = _migrate_csv(path, header, count)[0]
+    return _write_battles(path, header, count, battles)
+
+
+def _write_battles(path, header, count, battles):
+    names_before = len(header["names"]), len(header["moves"])
+    moves_file = moves_path(path)
+    moves_offset = os.path.getsize(moves_file) if os.path.exists(moves_file) else 0
+    next_id = header.get("first_battle_id", 0) + count // 2
+
+    record_chunks, move_chunks, ids = [], [], []
+    for entries in battles:
+        records, moves = pack_battle(header, next_id, moves_offset, entries)
+        record_chunks.append(records)
+        move_chunks.append(moves)
+        moves_offset += len(moves)
+        ids.append(next_id)
+        next_id += 1
+
+    with open(moves_file, "ab") as file:
+        file.write(b"".join(move_chunks))
+    with open(path, "r+b") as file:
+        if (len(header["names"]), len(header["moves"])) != names_before:
+            file.write(encode_header(header))
+        file.seek(0, os.SEEK_END)
+        file.write(b"".join(record_chunks))
+    return ids
+
+
+def append_battle(path, entries):
+    return append_battles(path, [entries])[0]
+
+
+def open_records(path, start=0, stop=None, dtype=None):
+    """Memory-maps the complete records in [start, stop); a torn tail is ignored. dtype
+    is record_dtype() unless given."""
+    import numpy as np
+    dtype = dtype or record_dtype()
+    count = record_count(path, dtype.itemsize)
+    stop = count if stop is None else min(stop, count)
+    if stop <= start:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=HEADER_SIZE + start * dtype.itemsize,
+                     shape=(stop - start,))
+
+
+def open_moves(path):
+    import numpy as np
+    moves_file = moves_path(path)
+    if not os.path.exists(moves_file) or os.path.getsize(moves_file) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(moves_file, dtype=np.uint8, mode="r")
+
+
+def explode_moves(records, moves):
+    """Flattens the movesets of records into parallel arrays, without a Python loop.
+
+    Returns (record index, turn index, move code), one entry per move played.
+    """
+    import numpy as np
+    counts = records["moves_count"].astype(np.int64)
+    total = int(counts.sum())
+    record_index = np.repeat(np.arange(len(records)), counts)
+    firsts = np.cumsum(counts) - counts
+    turn_index = np.arange(total) - np.repeat(firsts, counts)
+    positions = np.repeat(records["moves_offset"].astype(np.int64), counts) + turn_index
+    return record_index, turn_index, np.asarray(moves[positions])
+
+
+def verify(path):
+    """Checks the log's structure; returns a list of problems (empty when it is sound)."""
+    import numpy as np
+    problems = []
+    records = open_records(path)
+    if (os.path.getsize(path) - HEADER_SIZE) % RECORD_SIZE:
+        problems.append("torn record at the end (ignored by readers)")
+    if len(records) % 2:
+        problems.append(f"odd record count {len(records)}")
+    pairs = records[:len(records) // 2 * 2]
+    ids = pairs["battle_id"]
+    if np.any(ids[0::2] != ids[1::2]):
+        problems.append("a battle's records are not adjacent")
+    if np.any(np.diff(ids[0::2].astype(np.int64)) != 1):
+        problems.append("battle ids are not consecutive")
+    ends = records["moves_offset"].astype(np.int64) + records["moves_count"]
+    if len(records) and ends.max() > len(open_moves(path)):
+        problems.append("a record points past the end of the moves file")
+    return problems
+
+
+def read_legacy_csv(csv_path):
+    """Yields battles from the old CSV: rows in pairs, blank row between battles."""
+    with open(csv_path, newline="") as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        battle = []
+        for row in reader:
+            if not row:
+                if battle:
+                    yield battle
+                battle = []
+                continue
+            battle.append(row)
+        if battle:
+            yield battle
+
+
+def legacy_csv_path(path):
+    """The old CSV log a binary log takes over: combat_log.csv for combat_log.bin."""
+    return os.path.splitext(path)[0] + ".csv"
+
+
+def legacy_entries(rows):
+    """One CSV battle as entry dicts, or None when it is not a pair of rows."""
+    if len(rows) != 2:
+        return None
+    return [{
+        "name": row[0], "opponent": rows[1 - side][0], "result": UNKNOWN, "side": side,
+        "damage_dealt": int(row[1]), "healing_done": int(row[2]), "damage_mitigated": int(row[3]),
+        "moves": ast.literal_eval(row[4]) if len(row) > 4 and row[4] else []
+    } for side, row in enumerate(rows)]
+
+
+def _import_csv(path, header, count, csv_path, batch=10000):
+    """Appends the battles of csv_path; returns (record count, converted, dropped).
+    Call under the lock."""
+    pending = []
+    converted = dropped = 0
+    for rows in read_legacy_csv(csv_path):
+        entries = legacy_entries(rows)
+        if entries is None:
+            dropped += 1
+            continue
+        pending.append(entries)
+        if len(pending) >= batch:
+            count += 2 * len(_write_battles(path, header, count, pending))
+            converted += len(pending)
+            pending = []
+    count += 2 * len(_write_battles(path, header, count, pending))
+    return count, converted + len(pending), dropped
+
+
+def _migrate_csv(path, header, count):
+    """Folds the legacy CSV beside the log in, once: the header remembers that it was, so
+    a log created by the first battle still picks up the CSV and never does it twice.
+    Call under the lock; returns (record count, converted, dropped)."""
+    header["csv_migrated"] = True
+    with open(path, "r+b") as file:
+        file.write(encode_header(header))
+    csv_path = legacy_csv_path(path)
+    if not os.path.exists(csv_path):
+        return count, 0, 0
+    return _import_csv(path, header, count, csv_path)
+
+
+def migrate_csv(path=LOG_FILE):
+    """Merges the legacy CSV into the log if it has not been yet; returns (converted, dropped)."""
+    with locked(path):
+        header, count = _open_for_append(path)
+        if header.get("csv_migrated"):
+            return 0, 0
+        return _migrate_csv(path, header, count)[1:]
+
+
+def convert_csv(csv_path=LEGACY_CSV, path=LOG_FILE, batch=10000):
+    """Converts csv_path into a new log at path; returns (converted, dropped). Battles that
+    are not a pair of rows are dropped, since every battle in the log is two records."""
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} already exists")
+    with locked(path):
+        header, count = _open_for_append(path)
+        header["csv_migrated"] = True
+        with open(path, "r+b") as file:
+            file.write(encode_header(header))
+        return _import_csv(path, header, count, csv_path, batch)[1:]
+
+
+def benchmark(battles):
+    """Writes the same synthetic battles in both formats and times a full load of each."""
+    import random
+    import tempfile
+    import pandas as pd
+    rng = random.Random(0)
+    directory = tempfile.mkdtemp()
+    csv_path = os.path.join(directory, "bench.csv")
+    bin_path = os.path.join(directory, "bench.bin")
+    with open(csv_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Name", "Damage Dealt", "Healing Done", "Damage Mitigated", "Movesets"])
+        for _ in range(battles):
+            for name in ("Meepo", "Visor"):
+                moves = [rng.choice(DEFAULT_MOVES) for _ in range(rng.randint(3, 20))]
+                writer.writerow([name, rng.randint(0, 300), rng.randint(0, 100), rng.randint(0, 50), moves])
+            writer.writerow([])
+    convert_csv(csv_path, bin_path)
+
+    start = time.perf_counter()
+    frame = pd.read_csv(csv_path)
+    parsed = [ast.literal_eval(m) for m in frame["Movesets"]]
+    csv_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    records = open_records(bin_path)
+    totals = records["damage_dealt"].sum() + open_moves(bin_path).sum()
+    bin_seconds = time.perf_counter() - start
+    csv_size = os.path.getsize(csv_path)
+    moves_size = os.path.getsize(moves_path(bin_path))
+    bin_size = os.path.getsize(bin_path) + moves_size
+    print(f"{battles} battles, {len(parsed)} rows, checksum {totals}")
+    print(f"csv: {csv_size / 1e6:.1f} MB ({csv_size / battles:.0f} B per battle), load+parse {csv_seconds:.2f}s")
+    print(f"bin: {bin_size / 1e6:.1f} MB ({2 * RECORD_SIZE} B of records + {moves_size / battles:.0f} B of moves "
+          f"per battle), map+scan {bin_seconds:.3f}s")
+    print(f"bin is {csv_size / bin_size:.1f}x smaller and loads {csv_seconds / max(bin_seconds, 1e-9):.0f}x faster")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "convert"
+    if command == "convert":
+        source = sys.argv[2] if len(sys.argv) > 2 else LEGACY_CSV
+        target = sys.argv[3] if len(sys.argv) > 3 else LOG_FILE
+        converted, dropped = convert_csv(source, target)
+        print(f"Converted {converted} battles from {source} into {target}"
+              + (f", dropped {dropped} that were not a pair of rows" if dropped else ""))
+    elif command == "bench":
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 100000)
+    elif command == "verify":
+        target = sys.argv[2] if len(sys.argv) > 2 else LOG_FILE
+        problems = verify(target)
+        print(f"{target}: {record_count(target)} records, " + ("; ".join(problems) if problems else "ok"))
+        sys.exit(1 if problems else 0)
+    else:
+        print("usage: python combat_log.py [convert [csv] [bin] | bench [battles] | verify [bin]]")
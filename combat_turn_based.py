@@ -1,36 +1,41 @@
-import pygame
-import random
+import startup_profile
+with startup_profile.step("import pygame"):
+    import pygame
 import os
 import attribute as atr
-import csv
+import combat_log
+from event_log import EventLog, EVENT_FILE
 import sys
+from battle_engine import BattleObserver, Character, Battle
+import enemy_ai
+import replay
+from hud import Hud, Button, Label
+from dirty_rects import DirtyRenderer, FrameCost
+from frame_timing import FixedTimestep, FramePacing, AnimationClock, parry_window_edges
+from sound_bank import load_sound, clear_sounds
 
-pygame.init()
 
-WIDTH, HEIGHT = 1280, 720
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Starry Night - Turn-Based Combat")
-background_image = pygame.image.load("battle_bg.png").convert()
+# Decoded sheets and their sliced frames are shared by every CharacterSprite in the
+# process, so a sheet is decoded and converted once no matter how often it is asked for.
+_sheet_cache = {}
+_frame_cache = {}
 
-font = pygame.font.Font(None, 36)
-small_font = pygame.font.Font(None, 24)
-large_font = pygame.font.Font(None, 72)
 
-WHITE = (255, 255, 255)
-BLACK = (0, 0, 0)
-RED = (255, 0, 0)
-GREEN = (0, 255, 0)
-BLUE = (0, 0, 255)
+def load_sprite_sheet(path):
+    sheet = _sheet_cache.get(path)
+    if sheet is None:
+        sheet = pygame.image.load(path).convert_alpha()
+        _sheet_cache[path] = sheet
+    return sheet
 
-def load_sound(path):
-    try:
-        return pygame.mixer.Sound(path)
-    except pygame.error:
-        print(f"Could not load sound: {path}")
-        return None
 
 def load_sprite_frames(path, frame_width, frame_height, columns, rows):
-    sheet = pygame.image.load(path).convert_alpha()
+    key = (path, frame_width, frame_height, columns, rows)
+    frames = _frame_cache.get(key)
+    if frames is not None:
+        return frames
+
+    sheet = load_sprite_sheet(path)
     frames = []
     for row in range(rows):
         for col in range(columns):
@@ -39,26 +44,64 @@ def load_sprite_frames(path, frame_width, frame_height, columns, rows):
                 raise ValueError(f"Frame {rect} is out of bounds for image size {sheet.get_size()}")
             frame = sheet.subsurface(rect)
             frames.append(frame)
+    _frame_cache[key] = frames
     return frames
 
 
+# Frames scaled to their on-screen size, keyed by (sheet key, frame index, size) and
+# filled lazily the first time a frame is drawn at that size.
+_scaled_cache = {}
+
+
+def get_scaled_frame(sheet_key, index, size):
+    key = (sheet_key, index, size)
+    frame = _scaled_cache.get(key)
+    if frame is None:
+        frame = pygame.transform.scale(load_sprite_frames(*sheet_key)[index], size)
+        _scaled_cache[key] = frame
+    return frame
+
+
+def clear_scaled_frames():
+    _scaled_cache.clear()
+
+
+def evict_sprite_frames(folder):
+    """Drops every cached sheet under folder, e.g. when that stage is unloaded."""
+    prefix = folder.rstrip("/") + "/"
+    for path in [p for p in _sheet_cache if p.startswith(prefix)]:
+        del _sheet_cache[path]
+    for key in [k for k in _frame_cache if k[0].startswith(prefix)]:
+        del _frame_cache[key]
+    for key in [k for k in _scaled_cache if k[0][0].startswith(prefix)]:
+        del _scaled_cache[key]
+
 
-class Character:
-    def __init__(self, attr):
-        self.name = attr["name"]
-        self.health = attr["health"]
-        self.max_health = attr["health"]
-        self.mana = attr["mana"]
-        self.max_mana = attr["mana"]
-        self.strength = attr["strength"]
-        self.defense = attr["defense"]
-        self.abilities = attr["abilities"]
-        self.items = attr["items"]
+def clear_sprite_cache():
+    _sheet_cache.clear()
+    _frame_cache.clear()
+    _scaled_cache.clear()
+
+
+def sprite_cache_bytes():
+    # frames are subsurfaces, so the sheets hold all the pixel memory
+    return sum(sheet.get_width() * sheet.get_height() * sheet.get_bytesize() for sheet in _sheet_cache.values())
+
+
+
+SPRITE_SIZE = (200, 200)
+EFFECT_SIZE = (100, 100)
+STATUS_EFFECTS = ("fireball", "heal", "smoke")
+
+
+class CharacterSprite(BattleObserver):
+    def __init__(self, character, attr):
+        self.character = character
         self.sfx_path = attr.get("sfx", "")
         self.sprite_folder = attr.get("sprite", None)
-        self.moveset = []
 
         self.animations = {}
+        self.animation_sheets = {}
         if self.sprite_folder:
             idle_path = f"{self.sprite_folder}/idle.png"
             attack_path = f"{self.sprite_folder}/attack.png"
@@ -68,35 +111,56 @@ class Character:
             smoke_path = f"{self.sprite_folder}/smoke.png"
 
             if os.path.exists(idle_path):
-                self.animations["idle"] = load_sprite_frames(idle_path, 32, 32, 1, 1)
+                self.load_animation("idle", idle_path, 32, 32, 1, 1)
             if os.path.exists(attack_path):
-                self.animations["attack"] = load_sprite_frames(attack_path, 32, 32, 4, 1)
-                self.animations["kick"] = load_sprite_frames(attack_path, 32, 32, 4, 1)
-                self.animations["swipe"] = load_sprite_frames(attack_path, 32, 32, 4, 1)
+                self.load_animation("attack", attack_path, 32, 32, 4, 1)
+                self.load_animation("kick", attack_path, 32, 32, 4, 1)
+                self.load_animation("swipe", attack_path, 32, 32, 4, 1)
             if os.path.exists(parry_path):
-                self.animations["parry"] = load_sprite_frames(parry_path, 32, 32, 4, 1)
+                self.load_animation("parry", parry_path, 32, 32, 4, 1)
             if os.path.exists(fireball_path):
-                self.animations["fireball"] = load_sprite_frames(fireball_path, 64, 64, 4, 5)
+                self.load_animation("fireball", fireball_path, 64, 64, 4, 5)
             if os.path.exists(heal_path):
-                self.animations["heal"] = load_sprite_frames(heal_path, 64, 64, 5, 2)
+                self.load_animation("heal", heal_path, 64, 64, 5, 2)
             if os.path.exists(smoke_path):
-                self.animations["smoke"] = load_sprite_frames(smoke_path, 64, 64, 4, 5)
+                self.load_animation("smoke", smoke_path, 64, 64, 4, 5)
 
         self.current_animation = "idle"
         self.current_frame = 0
-        self.animation_timer = 0
         self.is_animating = False
-        self.total_m_dam = 0
-        self.total_damage_dealt = 0
-        self.total_healing_done = 0
-        self.defend_stance = 0
+        self.animation_clock = AnimationClock()
         self.sounds = self.load_sounds()
         self.status_effect_animation = None
         self.status_effect_frame = 0
-        self.status_effect_timer = 0
+        self.status_effect_clock = AnimationClock()
+        character.attach(self)
+
+    def load_animation(self, name, path, frame_width, frame_height, columns, rows):
+        sheet_key = (path, frame_width, frame_height, columns, rows)
+        self.animations[name] = load_sprite_frames(*sheet_key)
+        self.animation_sheets[name] = sheet_key
+
+    def prescale(self):
+        for name, sheet_key in self.animation_sheets.items():
+            size = EFFECT_SIZE if name in STATUS_EFFECTS else SPRITE_SIZE
+            for index in range(len(self.animations[name])):
+                get_scaled_frame(sheet_key, index, size)
+
+    def frame_surface(self, size):
+        return get_scaled_frame(self.animation_sheets[self.current_animation], self.current_frame, size)
+
+    def status_effect_surface(self, size):
+        return get_scaled_frame(self.animation_sheets[self.status_effect_animation], self.status_effect_frame, size)
+
+    def interpolate(self, ahead_ms):
+        """Picks the frames to draw ahead_ms past the last simulation step."""
+        if self.is_animating:
+            self.current_frame = self.animation_clock.frame(ahead_ms)
+        if self.status_effect_animation:
+            self.status_effect_frame = self.status_effect_clock.frame(ahead_ms)
 
     def load_sounds(self):
-        actions = ["attack", "defend", "parry"] + self.abilities + self.items
+        actions = ["attack", "defend", "parry"] + self.character.abilities + self.character.items
         sounds = {}
         for name in actions:
             path = f"{self.sfx_path}/{name}.wav"
@@ -104,241 +168,63 @@ class Character:
                 sounds[name] = load_sound(path)
         return sounds
 
-    def play_sound(self, action):
+    def on_sound(self, character, action):
         sound = self.sounds.get(action)
         if sound:
             sound.play()
 
-    def start_animation(self, animation):
+    def on_animation(self, character, animation):
         if animation in self.animations:
             self.current_animation = animation
             self.current_frame = 0
-            self.animation_timer = 0
+            self.animation_clock.start(animation, len(self.animations[animation]))
             self.is_animating = True
 
-    def animate(self):
-            if self.is_animating:
-                self.animation_timer += 1
-                if self.animation_timer >= 5:
-                    self.current_frame += 1
-                    self.animation_timer = 0
-
-                    if self.current_animation == "attack":
-                        if self.current_frame == 2:
-                            battle.parry_window = True
-                            battle.parry_timer = pygame.time.get_ticks()
-                        elif self.current_frame == 4:
-                            battle.parry_window = False
-                    if self.current_animation == "smoke" or self.current_animation == "fireball":
-                        if self.current_frame == 2:
-                            battle.parry_window = True
-                            battle.parry_timer = pygame.time.get_ticks()
-                        elif self.current_frame == 10:
-                            battle.parry_window = False
-
-                if self.current_frame >= len(self.animations[self.current_animation]):
-                    self.current_frame = 0
-                    self.is_animating = False
-                    self.current_animation = "idle"
-
-            if self.status_effect_animation:
-                self.status_effect_timer += 1
-                if self.status_effect_timer >= 5:
-                    self.status_effect_timer = 0
-                    self.status_effect_frame += 1
-                    if self.status_effect_frame >= len(self.animations[self.status_effect_animation]):
-                        self.status_effect_animation = None
-                        self.status_effect_frame = 0
-
-
-    def attack(self, target):
-        damage = max(1, self.strength - target.defense // 5)
-        if target.defend_stance == 1:
-            damage //= 2
-        p = target.take_damage(damage)
-        if p == 1:
-            target.play_sound("parry")
-            target.start_animation("parry")
-            target.total_m_dam += damage
-            target.moveset.append("parry")
-            return "Parried"
-        else:
-            self.total_damage_dealt += damage
-            self.play_sound("attack")
-            self.start_animation("attack")
-            self.moveset.append("attack")
-            return f"{self.name} attacks for {damage} damage!"
-
-    def defend(self):
-        self.defend_stance = 1
-        self.play_sound("defend")
-        self.moveset.append("defend")
-        return f"{self.name} defends!"
-
-    def use_ability(self, ability, target):
-        if ability in atr.ability_effects:
-            result = atr.ability_effects[ability](self, target)
-            self.play_sound(ability)
-            self.moveset.append(ability)
-            if ability == "Fireball":
-                self.start_animation("attack")
-                target.status_effect_animation = "fireball"
-                target.status_effect_frame = 0
-                target.status_effect_timer = 0
-            if ability == "Heal":
-                self.status_effect_animation = "heal"
-                self.status_effect_frame = 0
-                self.status_effect_timer = 0
-            if ability == "Smoke":
-                self.start_animation("attack")
-                target.status_effect_animation = "smoke"
-                target.status_effect_frame = 0
-                target.status_effect_timer = 0
-            return result
-        return "Invalid ability!"
-
-    def use_item(self, item, target):
-        if item in atr.item_effects:
-            result = atr.item_effects[item](self, target)
-            self.play_sound(item)
-            self.moveset.append("item")
-            return result
-        return "Invalid item!"
-
-    def take_damage(self, amount):
-        if battle.parry_success:
-            battle.parry_success = False
-            battle.parry_window = False
-            battle.action_message = "Parry! No damage taken!"
-            return 1
-
-        if self.defend_stance == 1:
-            self.health -= amount // 2
-            self.defend_stance = 0
-        else:
-            self.health -= amount
-
-    def take_turn(self, opponent):
-        move_type = random.choice(["attack", "defend", "ability", "item"])
-        if move_type == "attack":
-            return self.attack(opponent)
-        elif move_type == "defend":
-            return self.defend()
-        elif move_type == "ability" and self.abilities:
-            ability = random.choice(self.abilities)
-            return self.use_ability(ability, opponent)
-        elif move_type == "item" and self.items:
-            item = random.choice(self.items)
-            return self.use_item(item, opponent)
-
-class Battle:
-    def __init__(self, character1, character2):
-        self.character1 = character1
-        self.character2 = character2
-        self.is_character1_turn = True
-        self.game_over = False
-        self.action_message = "Choose your action!"
-        self.show_abilities = False
-        self.show_items = False
-        self.battle_report = ""
-        self.waiting_for_enemy = False
-        self.enemy_turn_time = None
-
-        # Parry mechanic
-        self.parry_window = False
-        self.parry_success = False
-        self.parry_timer = 0
-
-    def process_action(self, action, ability_choice=None, item_choice=None):
-        if self.game_over or not self.is_character1_turn:
-            return
-
-        if action == "attack":
-            self.action_message = self.character1.attack(self.character2)
-        elif action == "defend":
-            self.action_message = self.character1.defend()
-        elif action == "item":
-            if item_choice:
-                self.action_message = self.character1.use_item(item_choice, self.character2)
-                self.show_items = False
-            else:
-                self.show_items = not self.show_items
-                return
-        elif action == "ability":
-            if ability_choice:
-                self.action_message = self.character1.use_ability(ability_choice, self.character2)
-                self.show_abilities = False
-            else:
-                self.show_abilities = not self.show_abilities
-                return
+    def on_status_effect(self, character, animation):
+        self.status_effect_animation = animation
+        self.status_effect_frame = 0
+        self.status_effect_clock.start(animation, len(self.animations[animation]))
+
+    def animate(self, battle, ms):
+        """Moves the animations on by ms of simulated time."""
+        if self.is_animating:
+            before, after = self.animation_clock.advance(ms)
+            opens, closes = parry_window_edges(self.current_animation, before, after)
+            if opens:
+                battle.open_parry_window()
+            if closes:
+                battle.close_parry_window()
+            if self.animation_clock.name is None:
+                self.is_animating = False
+                self.current_animation = "idle"
+            self.current_frame = self.animation_clock.frame()
+
+        if self.status_effect_animation:
+            self.status_effect_clock.advance(ms)
+            if self.status_effect_clock.name is None:
+                self.status_effect_animation = None
+            self.status_effect_frame = self.status_effect_clock.frame()
 
-        self.is_character1_turn = False
-        self.waiting_for_enemy = True
-        self.enemy_turn_time = pygame.time.get_ticks() + 1000
-        self.check_win()
-
-    def update(self):
-        if self.waiting_for_enemy and pygame.time.get_ticks() >= self.enemy_turn_time:
-            if not self.game_over:
-                self.action_message = f"{self.character2.take_turn(self.character1)}"
-                self.check_win()
-            self.is_character1_turn = True
-            self.waiting_for_enemy = False
-
-    def check_win(self):
-        if self.character1.health <= 0:
-            self.action_message = "You lose!"
-            self.game_over = True
-            self.battle_report = self.generate_combat_report()
-            self.save_combat_report_to_csv()
-        elif self.character2.health <= 0:
-            self.action_message = "You win!"
-            self.game_over = True
-            self.battle_report = self.generate_combat_report()
-            self.save_combat_report_to_csv()
-
-    def generate_combat_report(self):
-        report = f"{self.character1.name} dealt {self.character1.total_damage_dealt} damage.\n"
-        report += f"{self.character1.name} healed {self.character1.total_healing_done} HP.\n"
-        report += f"{self.character1.name} mitigated {self.character1.total_m_dam} damage.\n"
-        report += f"{self.character2.name} dealt {self.character2.total_damage_dealt} damage.\n"
-        report += f"{self.character2.name} healed {self.character2.total_healing_done} HP.\n"
-        return report
-
-    def save_combat_report_to_csv(self, filename="combat_log.csv"):
-        file_exists = os.path.isfile(filename)
-        with open(filename, mode="a", newline="") as file:
-            writer = csv.writer(file)
-            if not file_exists:
-                writer.writerow(["Name", "Damage Dealt", "Healing Done", "Damage Mitigated", "Movesets"])
-            writer.writerow([
-                self.character1.name,
-                self.character1.total_damage_dealt,
-                self.character1.total_healing_done,
-                self.character1.total_m_dam,
-                self.character1.moveset
-            ])
-            writer.writerow([
-                self.character2.name,
-                self.character2.total_damage_dealt,
-                self.character2.total_healing_done,
-                self.character2.total_m_dam,
-                self.character2.moveset
-            ])
-            writer.writerow([])
 
 class GameInstance:
-    def __init__(self, hero_atr, enemy_atr):
-        pygame.init()
-        self.background = pygame.image.load("battle_bg.png").convert()
-        self.sounds = self.load_sounds()
+    def __init__(self, hero_atr=None, enemy_atr=None, dirty_rects=False, show_frame_cost=False, hidden=False,
+                 enemy_policy="random", fps=60, show_frame_pacing=False):
+        with startup_profile.step("pygame.init"):
+            pygame.init()
+        with startup_profile.step("menu sounds"):
+            self.sounds = self.load_sounds()
         self.WIDTH, self.HEIGHT = 1280, 720
-        self.screen = pygame.display.set_mode((self.WIDTH, self.HEIGHT))
-        pygame.display.set_caption("Starry Night - Turn-Based Combat")
-
-        self.font = pygame.font.Font(None, 36)
-        self.small_font = pygame.font.Font(None, 24)
-        self.large_font = pygame.font.Font(None, 72)
+        with startup_profile.step("display"):
+            self.screen = pygame.display.set_mode((self.WIDTH, self.HEIGHT), pygame.HIDDEN if hidden else 0)
+            self.display_size = self.screen.get_size()
+            pygame.display.set_caption("Starry Night - Turn-Based Combat")
+        with startup_profile.step("background"):
+            self.background = pygame.image.load("battle_bg.png").convert()
+
+        with startup_profile.step("fonts"):
+            self.font = pygame.font.Font(None, 36)
+            self.small_font = pygame.font.Font(None, 24)
+            self.large_font = pygame.font.Font(None, 72)
 
         self.colors = {
             "white": (255, 255, 255),
@@ -347,92 +233,168 @@ class GameInstance:
             "green": (0, 255, 0),
             "blue": (0, 0, 255)
         }
-        global battle
+        self.clock = pygame.time.Clock()
+        self.fps = fps
+        # battles run on simulated time in fixed steps, see frame_timing.py
+        self.timestep = FixedTimestep()
+        self.frame_pacing = FramePacing(fps)
+        self.show_frame_pacing = show_frame_pacing
+        self.dirty_rects = dirty_rects
+        self.dirty_renderer = None
+        self.frame_cost = FrameCost((self.WIDTH, self.HEIGHT))
+        self.show_frame_cost = show_frame_cost or dirty_rects
+        self.battle = None
+        self.events = EventLog(EVENT_FILE)
+        # one policy for the session, so its transposition cache carries over between
+        # battles; it thinks in its own process while the frames keep coming
+        self.enemy_policy = enemy_ai.POLICIES[enemy_policy]()
+        self.thinker = enemy_ai.process_thinker(self.enemy_policy)
+        if hero_atr and enemy_atr:
+            with startup_profile.step("stage assets"):
+                self.start_battle(hero_atr, enemy_atr)
+
+    def prewarm(self, attrs):
+        """Decodes and pre-scales every sheet and sound the given characters use."""
+        with startup_profile.step("prewarm roster"):
+            for attr in attrs:
+                CharacterSprite(Character(attr), attr).prescale()
+
+    def start_battle(self, hero_atr, enemy_atr):
         self.hero = Character(hero_atr)
         self.enemy = Character(enemy_atr)
-        self.battle = Battle(self.hero, self.enemy)
-        battle = self.battle
-        self.clock = pygame.time.Clock()
-        self.buttons = {}
+        self.attributes = (hero_atr, enemy_atr)
+        self.sprites = [CharacterSprite(self.hero, hero_atr), CharacterSprite(self.enemy, enemy_atr)]
+        self.battle = Battle(self.hero, self.enemy, clock=self.timestep.clock,
+                             log_file=combat_log.LOG_FILE, events=self.events,
+                             enemy_policy=self.enemy_policy, thinker=self.thinker, record=True)
+        self.build_hud()
+        self.dirty_renderer = DirtyRenderer(self.background) if self.dirty_rects else None
+        pygame.event.clear()
         pygame.mixer.music.load("sfx/battle_bgm.wav")
         pygame.mixer.music.play(-1)
 
-    def draw_button(self, text, x, y, w, h, color=None):
-        color = color or self.colors["blue"]
-        rect = pygame.draw.rect(self.screen, color, (x, y, w, h))
-        label = self.font.render(text, True, self.colors["white"])
-        self.screen.blit(label, (x + w // 2 - label.get_width() // 2, y + h // 2 - label.get_height() // 2))
-        return rect
+    def set_visible(self, visible):
+        self.screen = pygame.display.set_mode((self.WIDTH, self.HEIGHT), pygame.SHOWN if visible else pygame.HIDDEN)
+
+    def add_button(self, group, key, text, x, y, w, h, caption=None, caption_color=None):
+        return self.hud.add(group, Button(key, text, (x, y, w, h), self.font, self.colors["blue"],
+                                          self.colors["white"], caption, self.small_font, caption_color))
+
+    def build_hud(self):
+        white = self.colors["white"]
+        hero = self.battle.character1
+        self.hud = Hud()
+        self.hero_hp_label = Label(self.font, white, (50, 30))
+        self.enemy_hp_label = Label(self.font, white, (self.WIDTH - 250, 30))
+        self.message_label = Label(self.font, white, (self.WIDTH // 2 - 200, self.HEIGHT - 600))
+
+        bw, bh = 180, 60
+        start_x = (self.WIDTH - (4 * bw + 3 * 20)) // 2
+        y_pos = self.HEIGHT - 100
+        for i, (key, text) in enumerate([("attack", "Attack"), ("defend", "Defend"),
+                                         ("ability", "Ability"), ("item", "Item")]):
+            self.add_button("actions", key, text, start_x + i * (bw + 20), y_pos, bw, bh)
+
+        for i, ab in enumerate(hero.abilities):
+            cost = atr.ability_specs[ab]["description"]
+            self.add_button("abilities", f"ability_{i}", ab, 250 + i * 200, self.HEIGHT - 200, 180, 60,
+                            cost, white)
+        for i, item in enumerate(hero.items):
+            effect = atr.item_specs[item]["description"]
+            self.add_button("items", f"item_{i}", item, 250 + i * 200, self.HEIGHT - 200, 180, 60,
+                            effect, self.colors["black"])
+
+        self.add_button("game_over", "stage", "Back", self.WIDTH // 2 - 200, self.HEIGHT - 150, 180, 60)
+        self.add_button("game_over", "quit", "Quit", self.WIDTH // 2 + 20, self.HEIGHT - 150, 180, 60)
+        self.result_label = Label(self.large_font, white, (self.WIDTH // 2, self.HEIGHT // 4), anchor="center")
+        self.report_title = Label(self.font, white, (50, self.HEIGHT // 2 - 50))
+        self.report_title.set_text("Combat Report:")
+        self.report_labels = []
+
+    def bar_item(self, key, x, y, w, h, value, maximum, color):
+        def draw(screen):
+            pygame.draw.rect(screen, self.colors["red"], (x, y, w, h))
+            pygame.draw.rect(screen, color, (x, y, w * (value / maximum), h))
+        return key, pygame.Rect(x, y, w, h), value, draw
+
+    def label_item(self, key, label):
+        return key, label.rect, (label.text, label.color), label.draw
+
+    def surface_item(self, key, surface, pos, signature):
+        return key, surface.get_rect(topleft=pos), signature, lambda screen: screen.blit(surface, pos)
+
+    def scene_items(self):
+        battle = self.battle
+        hero, enemy = battle.character1, battle.character2
+        if battle.game_over:
+            items = [self.label_item("result", self.result_label), self.label_item("report", self.report_title)]
+            items += [self.label_item(f"report_{i}", label) for i, label in enumerate(self.report_labels)]
+        else:
+            items = [
+                self.bar_item("hero_hp", 50, 60, 200, 30, hero.health, hero.max_health, self.colors["green"]),
+                self.bar_item("hero_mp", 50, 95, 200, 20, hero.mana, hero.max_mana, self.colors["blue"]),
+                self.bar_item("enemy_hp", self.WIDTH - 250, 60, 200, 30, enemy.health, enemy.max_health, self.colors["green"]),
+                self.label_item("hero_label", self.hero_hp_label),
+                self.label_item("enemy_label", self.enemy_hp_label),
+                self.label_item("message", self.message_label)
+            ]
+            for i, sprite in enumerate(self.sprites):
+                pos_x = 100 if i == 0 else self.WIDTH - 300
+                items.append(self.surface_item(f"sprite_{i}", sprite.frame_surface(SPRITE_SIZE), (pos_x, self.HEIGHT // 2 - 100),
+                                               (sprite.current_animation, sprite.current_frame)))
+                if sprite.status_effect_animation:
+                    items.append(self.surface_item(f"effect_{i}", sprite.status_effect_surface(EFFECT_SIZE),
+                                                   (pos_x + 50, self.HEIGHT // 2 - 130),
+                                                   (sprite.status_effect_animation, sprite.status_effect_frame)))
+        for button in self.hud.visible_buttons():
+            items.append((f"button_{button.key}", button.bounds(), None, button.draw))
+        return items
 
     def draw_battle_screen(self):
-        self.screen.blit(self.background, (0, 0))
+        if self.screen.get_size() != self.display_size:
+            # scaled frames were sized for the old display
+            clear_scaled_frames()
+            if self.dirty_renderer:
+                self.dirty_renderer.invalidate()
+            self.display_size = self.screen.get_size()
         battle = self.battle
 
-        pygame.draw.rect(self.screen, self.colors["red"], (50, 60, 200, 30))
-        pygame.draw.rect(self.screen, self.colors["green"], (50, 60, 200 * (battle.character1.health / battle.character1.max_health), 30))
-        pygame.draw.rect(self.screen, self.colors["red"], (50, 95, 200, 20))
-        pygame.draw.rect(self.screen, self.colors["blue"], (50, 95, 200 * (battle.character1.mana / battle.character1.max_mana), 20))
-        pygame.draw.rect(self.screen, self.colors["red"], (self.WIDTH - 250, 60, 200, 30))
-        pygame.draw.rect(self.screen, self.colors["green"], (self.WIDTH - 250, 60, 200 * (battle.character2.health / battle.character2.max_health), 30))
-
-        self.screen.blit(self.font.render(f"{battle.character1.name} HP: {battle.character1.health}", True, self.colors["white"]), (50, 30))
-        self.screen.blit(self.font.render(f"{battle.character2.name} HP: {battle.character2.health}", True, self.colors["white"]), (self.WIDTH - 250, 30))
-        self.screen.blit(self.font.render(battle.action_message, True, self.colors["white"]), (self.WIDTH // 2 - 200, self.HEIGHT - 600))
-
-        battle.character1.animate()
-        battle.character2.animate()
-        for i, character in enumerate([battle.character1, battle.character2]):
-            frame = character.animations[character.current_animation][character.current_frame]
-            pos_x = 100 if i == 0 else self.WIDTH - 300
-            self.screen.blit(pygame.transform.scale(frame, (200, 200)), (pos_x, self.HEIGHT // 2 - 100))
-            if character.status_effect_animation:
-                effect_frame = character.animations[character.status_effect_animation][character.status_effect_frame]
-                effect_pos = (pos_x + 50, self.HEIGHT // 2 - 130)
-                self.screen.blit(pygame.transform.scale(effect_frame, (100, 100)), effect_pos)
-
-        self.buttons.clear()
-        if not battle.game_over and battle.is_character1_turn:
-            bw, bh = 180, 60
-            start_x = (self.WIDTH - (4 * bw + 3 * 20)) / 2
-            y_pos = self.HEIGHT - 100
-            self.buttons["attack"] = self.draw_button("Attack", start_x, y_pos, bw, bh)
-            self.buttons["defend"] = self.draw_button("Defend", start_x + bw + 20, y_pos, bw, bh)
-            self.buttons["ability"] = self.draw_button("Ability", start_x + 2 * (bw + 20), y_pos, bw, bh)
-            self.buttons["item"] = self.draw_button("Item", start_x + 3 * (bw + 20), y_pos, bw, bh)
+        self.hero_hp_label.set_text(f"{battle.character1.name} HP: {battle.character1.health}")
+        self.enemy_hp_label.set_text(f"{battle.character2.name} HP: {battle.character2.health}")
+        self.message_label.set_text(battle.action_message)
+        ahead_ms = self.timestep.alpha() * self.timestep.step_ms
+        for sprite in self.sprites:
+            sprite.interpolate(ahead_ms)
 
+        groups = []
+        if not battle.game_over and battle.is_character1_turn:
+            groups.append("actions")
         if battle.show_abilities:
-            for i, ab in enumerate(battle.character1.abilities):
-                ab_btn = self.draw_button(ab, 250 + i * 200, self.HEIGHT - 200, 180, 60)
-                cost = atr.ability_effects[ab].__doc__ or ""
-                cost_txt = self.small_font.render(cost, True, self.colors["white"])
-                self.screen.blit(cost_txt, (ab_btn.x + ab_btn.width // 2 - cost_txt.get_width() // 2, ab_btn.y + 65))
-                self.buttons[f"ability_{i}"] = ab_btn
-
+            groups.append("abilities")
         if battle.show_items:
-            for i, item in enumerate(battle.character1.items):
-                item_btn = self.draw_button(item, 250 + i * 200, self.HEIGHT - 200, 180, 60)
-                effect = atr.item_effects[item].__doc__ or ""
-                effect_txt = self.small_font.render(effect, True, self.colors["black"])
-                self.screen.blit(effect_txt, (item_btn.x + item_btn.width // 2 - effect_txt.get_width() // 2, item_btn.y + 65))
-                self.buttons[f"item_{i}"] = item_btn
+            groups.append("items")
+        self.hud.show(*groups)
 
         if battle.game_over:
             pygame.mixer.music.stop()
-            self.screen.blit(self.background, (0, 0))
-            victory_text = "Victory!" if battle.character1.health > 0 else "Defeat!"
-            text_rect = large_font.render(victory_text, True, GREEN if battle.character1.health > 0 else RED).get_rect(
-                center=(WIDTH // 2, HEIGHT // 4))
-            screen.blit(large_font.render(victory_text, True, GREEN if battle.character1.health > 0 else RED),
-                        text_rect)
-            report_text = font.render("Combat Report:", True, WHITE)
-            screen.blit(report_text, (50, HEIGHT // 2 - 50))
-
+            won = battle.character1.health > 0
+            self.result_label.set_text("Victory!" if won else "Defeat!",
+                                       self.colors["green"] if won else self.colors["red"])
             lines = battle.battle_report.split("\n")
-            for i, line in enumerate(lines):
-                screen.blit(small_font.render(line, True, WHITE), (50, HEIGHT // 2 + 10 + i * 30))
-
-            self.buttons["stage"] = self.draw_button("Back", WIDTH // 2 - 200, HEIGHT - 150, 180, 60)
-            self.buttons["quit"] = self.draw_button("Quit", WIDTH // 2 + 20, HEIGHT - 150, 180, 60)
+            while len(self.report_labels) < len(lines):
+                i = len(self.report_labels)
+                self.report_labels.append(Label(self.small_font, self.colors["white"], (50, self.HEIGHT // 2 + 10 + i * 30)))
+            for label, line in zip(self.report_labels, lines):
+                label.set_text(line)
+            self.hud.show("game_over")
+
+        items = self.scene_items()
+        if self.dirty_renderer:
+            return self.dirty_renderer.draw(self.screen, items)
+        self.screen.blit(self.background, (0, 0))
+        for _, _, _, draw in items:
+            draw(self.screen)
+        return None
 
     def load_sounds(self):
         sounds = {}
@@ -448,63 +410,158 @@ class GameInstance:
     def handle_input(self, event):
         if event.type == pygame.MOUSEBUTTONDOWN:
             mx, my = pygame.mouse.get_pos()
+            battle = self.battle
             if event.button == 3:
-                if self.battle.parry_window:
-                    self.battle.parry_success = True
+                if battle.try_parry():
                     print("Parry activated!")
-            for key, btn in self.buttons.items():
-                if btn.collidepoint(mx, my):
-                    if key == "attack":
-                        battle.process_action("attack")
-                    elif key == "defend":
-                        battle.process_action("defend")
-                    elif key == "item":
-                        self.play_sound("select")
-                        battle.process_action("item")
-                    elif key == "ability":
-                        self.play_sound("select")
-                        battle.process_action("ability")
-                    elif key.startswith("ability_"):
-                        idx = int(key.split("_")[1])
-                        battle.process_action("ability", ability_choice=battle.character1.abilities[idx])
-                    elif key.startswith("item_"):
-                        idx = int(key.split("_")[1])
-                        battle.process_action("item", item_choice=battle.character1.items[idx])
-                    elif key == "quit":
-                        self.play_sound("back")
-                        self.running = False
-                    elif key == "stage":
-                        self.play_sound("back")
-                        self.running = False
-                        pygame.quit()
-
-
-    def run(self):
+            key = self.hud.button_at((mx, my))
+            if key is None:
+                return
+            if key == "attack":
+                battle.process_action("attack")
+            elif key == "defend":
+                battle.process_action("defend")
+            elif key == "item":
+                self.play_sound("select")
+                battle.process_action("item")
+            elif key == "ability":
+                self.play_sound("select")
+                battle.process_action("ability")
+            elif key.startswith("ability_"):
+                idx = int(key.split("_")[1])
+                battle.process_action("ability", ability_choice=battle.character1.abilities[idx])
+            elif key.startswith("item_"):
+                idx = int(key.split("_")[1])
+                battle.process_action("item", item_choice=battle.character1.items[idx])
+            elif key == "quit":
+                self.play_sound("back")
+                self.running = False
+            elif key == "stage":
+                self.play_sound("back")
+                self.running = False
+
+
+    def play(self, on_first_frame=None):
         self.running = True
+        self.clock.tick()  # the time spent outside play() is not a frame
         while self.running:
-            self.clock.tick(60)
-            self.battle.update()
+            frame_ms = self.clock.tick(self.fps)
+            # input first, at the simulated time of the frame the player was looking at
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     self.running = False
                 self.handle_input(event)
-            self.draw_battle_screen()
-            pygame.display.flip()
-
+            steps = 0
+            for _ in self.timestep.steps(frame_ms):
+                self.battle.update()
+                for sprite in self.sprites:
+                    sprite.animate(self.battle, self.timestep.step_ms)
+                steps += 1
+            self.frame_pacing.frame(frame_ms, steps)
+            self.frame_cost.begin()
+            dirty = self.draw_battle_screen()
+            if dirty is None:
+                pygame.display.flip()
+            else:
+                pygame.display.update(dirty)
+            self.frame_cost.end(dirty)
+            if on_first_frame:
+                on_first_frame()
+                on_first_frame = None
+            startup_profile.report("combat_turn_based.py")
+        pygame.mixer.music.stop()
+        self.events.flush()
+        replay.save_replay(replay.REPLAY_FILE, self.battle, *self.attributes)
+
+    def shutdown(self):
+        if self.show_frame_cost:
+            print(self.frame_cost.summary())
+        if self.show_frame_pacing:
+            print(self.frame_pacing.summary(self.timestep, self.battle.inputs if self.battle else None))
+        self.events.close()
+        if self.thinker is not None:
+            self.thinker.shutdown(wait=True, cancel_futures=True)
+        clear_sprite_cache()
+        clear_sounds()
         pygame.quit()
 
-if __name__ == "__main__":
-    level = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    def run(self):
+        self.play()
+        self.shutdown()
+
 
+def level_attributes(level):
     if level == 1:
-        enemy_attributes = atr.visor_attributes
+        return atr.visor_attributes
     elif level == 2:
-        enemy_attributes = atr.dunky_attributes
-    else:
-        print(f"Warning: Level {level} not defined, defaulting to Visor.")
-        enemy_attributes = atr.visor_attributes
+        return atr.dunky_attributes
+    print(f"Warning: Level {level} not defined, defaulting to Visor.")
+    return atr.visor_attributes
+
+
+VALUE_FLAGS = ("--enemy-policy", "--fps")
+
+
+def flag_value(flag, default):
+    if flag in sys.argv[:-1]:
+        return sys.argv[sys.argv.index(flag) + 1]
+    return default
+
+
+def enemy_policy_arg():
+    """--enemy-policy search plays against the search enemy instead of the random one."""
+    return flag_value("--enemy-policy", "random")
 
-    game = GameInstance(atr.meepo_attributes, enemy_attributes)
+
+def positional_args():
+    values = {i + 1 for i, arg in enumerate(sys.argv) if arg in VALUE_FLAGS}
+    return [arg for i, arg in enumerate(sys.argv) if i and i not in values and not arg.startswith("--")]
+
+
+def serve(commands=sys.stdin, replies=sys.stdout, dirty_rects=False, enemy_policy="random"):
+    """Persistent battle worker driven by main_menu.py over a pipe.
+
+    Everything that does not depend on the stage (pygame, the window, fonts,
+    background, every roster sheet and sound) is loaded once up front, then each
+    "start <level>" line plays one battle in the same process. Replies are lines
+    starting with "@" so they can be told apart from ordinary prints.
+    """
+    def reply(message):
+        replies.write(f"@{message}\n")
+        replies.flush()
+
+    game = GameInstance(dirty_rects=dirty_rects, hidden=True, enemy_policy=enemy_policy)
+    game.prewarm([atr.meepo_attributes, atr.visor_attributes, atr.dunky_attributes])
+    reply("ready")
+    startup_profile.report("battle worker")
+    for line in commands:
+        command = line.split()
+        if not command:
+            continue
+        if command[0] == "start":
+            game.start_battle(atr.meepo_attributes, level_attributes(int(command[1])))
+            game.set_visible(True)
+            game.play(on_first_frame=lambda: reply("frame"))
+            game.set_visible(False)
+            reply("done")
+        elif command[0] == "quit":
+            break
+    game.shutdown()
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        serve(dirty_rects="--dirty-rects" in sys.argv, enemy_policy=enemy_policy_arg())
+        sys.exit(0)
+
+    args = positional_args()
+    level = int(args[0]) if args else 1
+    enemy_attributes = level_attributes(level)
+
+    game = GameInstance(atr.meepo_attributes, enemy_attributes,
+                        dirty_rects="--dirty-rects" in sys.argv, show_frame_cost="--frame-cost" in sys.argv,
+                        enemy_policy=enemy_policy_arg(), fps=int(flag_value("--fps", 60)),
+                        show_frame_pacing="--frame-pacing" in sys.argv)
     game.run()
     print(level)
 
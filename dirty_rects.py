@@ -0,0 +1,84 @@
+import time
+import pygame
+
+# A scene is a list of (key, rect, signature, draw) items in back-to-front order.
+# The renderer remembers last frame's rect and signature per key and only repaints the
+# regions where something moved, changed, appeared or went away.
+
+
+class FrameCost:
+    def __init__(self, screen_size):
+        self.screen_pixels = screen_size[0] * screen_size[1]
+        self.frames = 0
+        self.pixels = 0
+        self.seconds = 0.0
+        self.started = 0.0
+
+    def begin(self):
+        self.started = time.perf_counter()
+
+    def end(self, rects=None):
+        self.seconds += time.perf_counter() - self.started
+        self.frames += 1
+        if rects is None:
+            self.pixels += self.screen_pixels
+        else:
+            self.pixels += sum(rect.width * rect.height for rect in rects)
+
+    def summary(self):
+        if not self.frames:
+            return "frame cost: no frames drawn"
+        pixels = self.pixels / self.frames
+        return (f"frame cost: {self.frames} frames, {pixels:.0f} px pushed per frame "
+                f"({100 * pixels / self.screen_pixels:.1f}% of the screen), "
+                f"{1000 * self.seconds / self.frames:.2f} ms draw per frame")
+
+
+def merge_rects(rects):
+    merged = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect.union_ip(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+
+class DirtyRenderer:
+    def __init__(self, background):
+        self.background = background
+        self.previous = None
+
+    def invalidate(self):
+        self.previous = None
+
+    def changed_rects(self, screen, current):
+        if self.previous is None:
+            return [screen.get_rect()]
+        dirty = []
+        for key, state in current.items():
+            old = self.previous.get(key)
+            if old is None:
+                dirty.append(state[0])
+            elif old != state:
+                dirty.append(old[0])
+                dirty.append(state[0])
+        for key, (rect, _) in self.previous.items():
+            if key not in current:
+                dirty.append(rect)
+        return merge_rects(dirty)
+
+    def draw(self, screen, items):
+        current = {key: (pygame.Rect(rect), signature) for key, rect, signature, _ in items}
+        dirty = self.changed_rects(screen, current)
+        for area in dirty:
+            screen.set_clip(area)
+            screen.blit(self.background, area, area)
+            for _, rect, _, draw in items:
+                if area.colliderect(rect):
+                    draw(screen)
+        screen.set_clip(None)
+        self.previous = current
+        return dirty
@@ -0,0 +1,165 @@
+import attribute as atr
+
+# Compiles the ability and item specs of attribute.py into one resolve(char, target)
+# per move. Everything a spec says is looked up once here, so a resolver only does the
+# arithmetic and the hooks that move actually has. A damage move works out its damage
+# and message for both defend stances once per (attacker, target, strength) and then
+# indexes them with target.defend_stance. Presentation hooks are skipped when neither
+# character has an observer, which is every battle the simulators play.
+
+
+def damage_pair(spec, strength):
+    damage = spec["amount"] + strength
+    return damage, damage // 2 if spec.get("halved_by_defend", True) else damage
+
+
+class Messages(dict):
+    """Battle messages, formatted once per (name, target, amount)."""
+
+    def __init__(self, template):
+        super().__init__()
+        self.template = template
+
+    def __missing__(self, key):
+        name, target, amount = key
+        text = self[key] = self.template.format(name=name, target=target, amount=amount)
+        return text
+
+
+def compile_hooks(name, spec):
+    """What the move shows after it resolved: its sound, animation and status effects."""
+    animation = spec.get("animation")
+    status_effect = spec.get("status_effect")
+    self_status_effect = spec.get("self_status_effect")
+
+    def present(char, target):
+        char.play_sound(name)
+        if animation:
+            char.start_animation(animation)
+        if status_effect:
+            target.show_status_effect(status_effect)
+        if self_status_effect:
+            char.show_status_effect(self_status_effect)
+    return present
+
+
+def compile_damage(name, spec, entry, present):
+    cost = spec.get("cost", 0)
+    scaling = spec.get("scaling")
+    parryable = spec.get("parryable", True)
+    sound = spec.get("sound")
+    target_animation = spec.get("target_animation")
+    messages = Messages(spec["message"])
+    no_mana = f"Not enough mana for {name}!"
+    tables = {}
+
+    def table(char, target, strength):
+        damages = damage_pair(spec, strength)
+        key = char.name, target.name, strength
+        tables[key] = damages, [messages[char.name, target.name, damage] for damage in damages]
+        return tables[key]
+
+    def resolve(char, target):
+        shown = char.observers or target.observers
+        if char.mana < cost:
+            result = no_mana
+        else:
+            strength = char.strength if scaling == "attacker" else target.strength if scaling == "target" else 0
+            damages, texts = tables.get((char.name, target.name, strength)) or table(char, target, strength)
+            stance = target.defend_stance
+            damage = damages[stance]
+            if parryable:
+                parried = target.take_damage(damage) == 1
+            else:
+                target.take_unparryable(damage)
+                parried = False
+            char.mana -= cost
+            if shown:
+                if sound:
+                    char.play_sound(sound)
+                if target_animation:
+                    target.start_animation(target_animation)
+            if parried:
+                if shown:
+                    target.play_sound("parry")
+                    target.start_animation("parry")
+                target.total_m_dam += damage
+                result = "Parried"
+            else:
+                char.total_damage_dealt += damage
+                result = texts[stance]
+        char.moveset.append(entry)
+        if shown:
+            present(char, target)
+        return result
+    return resolve
+
+
+def compile_heal(name, spec, entry, present):
+    cost = spec.get("cost", 0)
+    amount = spec["amount"]
+    messages = Messages(spec["message"])
+    no_mana = f"Not enough mana for {name}!"
+
+    def resolve(char, target):
+        if char.mana < cost:
+            result = no_mana
+        else:
+            healed = min(amount, char.max_health - char.health)
+            char.health += healed
+            char.mana -= cost
+            char.total_healing_done += healed
+            result = messages[char.name, target.name, healed]
+        char.moveset.append(entry)
+        if char.observers or target.observers:
+            present(char, target)
+        return result
+    return resolve
+
+
+def compile_mana(name, spec, entry, present):
+    amount = spec["amount"]
+    messages = Messages(spec["message"])
+
+    def resolve(char, target):
+        char.mana = min(char.max_mana, char.mana + amount)
+        char.moveset.append(entry)
+        if char.observers or target.observers:
+            present(char, target)
+        return messages[char.name, target.name, amount]
+    return resolve
+
+
+def compile_defense(name, spec, entry, present):
+    amount = spec["amount"]
+    messages = Messages(spec["message"])
+
+    def resolve(char, target):
+        char.defense += amount
+        char.moveset.append(entry)
+        if char.observers or target.observers:
+            present(char, target)
+        return messages[char.name, target.name, amount]
+    return resolve
+
+
+COMPILERS = {
+    "damage": compile_damage,
+    "heal": compile_heal,
+    "mana": compile_mana,
+    "defense": compile_defense
+}
+
+
+def compile_move(name, spec, entry):
+    """resolve(char, target) for one spec: applies it, appends entry to char's
+    moveset, runs the hooks and returns the battle message."""
+    return COMPILERS[spec["kind"]](name, spec, entry, compile_hooks(name, spec))
+
+
+def compile_all(specs, entry=None):
+    return {name: compile_move(name, spec, entry or name) for name, spec in specs.items()}
+
+
+abilities = compile_all(atr.ability_specs)
+items = compile_all(atr.item_specs, "item")
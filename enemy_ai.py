@@ -0,0 +1,259 @@
+import argparse
+import multiprocessing
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+import attribute as atr
+import battle_engine
+
+# Search-based enemy for battle_engine.Battle. The enemy maximises and the hero is a
+# chance node that moves the way Character.choose_move does (a random move type, then
+# a random ability or item), i.e. expectimax over the real rules: every node plays
+# its move through the same resolvers a battle uses, on Character.clone() copies that
+# are put back with snapshot() and restore() afterwards.
+# Parries are left out, nobody clicks in a look-ahead.
+#
+# The search deepens one round (an enemy move and the hero's reply) at a time until
+# the wall-clock budget runs out and keeps the best move of the deepest round it
+# finished. Values are kept in a bounded transposition cache, which outlives the turn,
+# so the next turn starts from what this one worked out.
+#
+# The battle screen runs the search in a worker process (process_thinker), so the
+# search and the render loop never compete for the GIL. The worker keeps its own
+# SearchPolicy, and with it the cache, for the whole session; each turn only the two
+# detached clone()s go over and the move and the search's stats come back.
+
+BUDGET_MS = 800  # inside battle_engine.ENEMY_TURN_DELAY_MS, with room for the process hand-off
+CACHE_SIZE = 200000
+MAX_DEPTH = 16
+WIN = 100.0
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class TranspositionCache:
+    """Least-recently-used (depth, value) per state, at most size entries."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, depth):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < depth:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, depth, value):
+        self.entries[key] = (depth, value)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+def state_key(actor, opponent):
+    return (actor.name, actor.strength, actor.health, actor.mana, actor.defense, actor.defend_stance,
+            opponent.name, opponent.strength, opponent.health, opponent.mana, opponent.defense,
+            opponent.defend_stance)
+
+
+def random_replies(char):
+    """(probability, move) for every move Character.choose_move can come up with."""
+    replies = [(0.25, ("attack", None)), (0.25, ("defend", None))]
+    for move_type, choices in (("ability", char.abilities), ("item", char.items)):
+        if choices:
+            replies += [(0.25 / len(choices), (move_type, choice)) for choice in choices]
+        else:
+            replies.append((0.25, None))  # the turn passes
+    return replies
+
+
+class SearchPolicy:
+    """Expectimax enemy with a per-turn time budget, see the top of the file."""
+    name = "search"
+    background = True
+
+    def __init__(self, budget_ms=BUDGET_MS, cache_size=CACHE_SIZE, max_depth=MAX_DEPTH):
+        self.budget_ms = budget_ms
+        self.cache_size = cache_size
+        self.max_depth = max_depth
+        self.cache = TranspositionCache(cache_size)
+        self.deadline = 0
+        self.nodes = 0
+        self.last_search = {}
+        self.searches = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.total_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_entries = 0
+
+    def choose(self, actor, opponent, rng=None):
+        start = time.perf_counter()
+        self.deadline = start + self.budget_ms / 1000
+        self.nodes = 0
+        hits, misses = self.cache.hits, self.cache.misses
+        actor, opponent = actor.clone(), opponent.clone()
+        moves = actor.legal_moves()
+        best, depth = moves[0], 0
+        for next_depth in range(1, self.max_depth + 1):
+            try:
+                best = max(moves, key=lambda move: self.after_move(actor, opponent, move, next_depth))
+            except SearchTimeout:
+                break
+            depth = next_depth
+        self.last_search = {
+            "move": best, "depth": depth, "nodes": self.nodes,
+            "ms": (time.perf_counter() - start) * 1000,
+            "cache_hits": self.cache.hits - hits, "cache_misses": self.cache.misses - misses,
+            "cache_size": len(self.cache.entries)
+        }
+        self.record(self.last_search)
+        return best
+
+    def record(self, search):
+        self.last_search = search
+        self.searches += 1
+        self.total_ms += search["ms"]
+        self.max_ms = max(self.max_ms, search["ms"])
+        self.total_depth += search["depth"]
+        self.cache_hits += search["cache_hits"]
+        self.cache_misses += search["cache_misses"]
+        self.cache_entries = search["cache_size"]
+
+    def submit(self, thinker, actor, opponent, rng=None):
+        """Starts choose() on thinker and returns a future of the move. On a
+        process_thinker the worker's own policy searches and its stats are recorded here."""
+        if not isinstance(thinker, ProcessPoolExecutor):
+            return thinker.submit(self.choose, actor, opponent, rng)
+        move = Future()
+
+        def done(future):
+            try:
+                best, search = future.result()
+            except BaseException as e:
+                move.set_exception(e)
+                return
+            self.record(search)
+            move.set_result(best)
+        thinker.submit(think, actor, opponent).add_done_callback(done)
+        return move
+
+    def summary(self):
+        searches = max(1, self.searches)
+        lookups = max(1, self.cache_hits + self.cache_misses)
+        return (f"{self.searches} searches, {self.total_ms / searches:.0f} ms avg {self.max_ms:.0f} ms max, "
+                f"depth {self.total_depth / searches:.1f} avg, cache hit rate {self.cache_hits / lookups:.2f} "
+                f"({self.cache_entries} entries)")
+
+    def evaluate(self, actor, opponent, depth):
+        # checked in Battle.check_win's order: the hero going down ends it first
+        if opponent.health <= 0:
+            return WIN + depth
+        if actor.health <= 0:
+            return -WIN - depth
+        return (actor.health / actor.max_health - opponent.health / opponent.max_health
+                + 0.05 * (actor.mana / max(1, actor.max_mana) - opponent.mana / max(1, opponent.max_mana)))
+
+    def best_value(self, actor, opponent, depth):
+        if depth == 0 or actor.health <= 0 or opponent.health <= 0:
+            return self.evaluate(actor, opponent, depth)
+        key = ("max",) + state_key(actor, opponent)
+        value = self.cache.get(key, depth)
+        if value is None:
+            value = max(self.after_move(actor, opponent, move, depth) for move in actor.legal_moves())
+            self.cache.put(key, depth, value)
+        return value
+
+    def after_move(self, actor, opponent, move, depth):
+        """Expected value of actor playing move, averaged over the opponent's replies."""
+        self.nodes += 1
+        if self.nodes & 63 == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        # moves are played on the copies choose() made and undone again; a timeout
+        # leaves them half-played, but they are thrown away with it
+        actor_state, opponent_state = actor.snapshot(), opponent.snapshot()
+        actor.perform(move, opponent)
+        if actor.health <= 0 or opponent.health <= 0:
+            value = self.evaluate(actor, opponent, depth)
+        else:
+            key = ("chance",) + state_key(actor, opponent)
+            value = self.cache.get(key, depth)
+            if value is None:
+                value = 0.0
+                played = actor.snapshot(), opponent.snapshot()
+                for probability, reply in random_replies(opponent):
+                    opponent.perform(reply, actor)
+                    value += probability * self.best_value(actor, opponent, depth - 1)
+                    actor.restore(played[0])
+                    opponent.restore(played[1])
+                self.cache.put(key, depth, value)
+        actor.restore(actor_state)
+        opponent.restore(opponent_state)
+        return value
+
+
+# the worker process's policy, see process_thinker
+worker_policy = None
+
+
+def start_worker(budget_ms, cache_size, max_depth):
+    global worker_policy
+    worker_policy = SearchPolicy(budget_ms, cache_size, max_depth)
+
+
+def think(actor, opponent):
+    move = worker_policy.choose(actor, opponent)
+    return move, worker_policy.last_search
+
+
+def process_thinker(policy):
+    """A one-process executor for policy.submit() that searches with policy's settings,
+    or None for a policy that does not think in the background."""
+    if not policy.background:
+        return None
+    # spawned, not forked: the parent has pygame and its threads going
+    thinker = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                                  initializer=start_worker,
+                                  initargs=(policy.budget_ms, policy.cache_size, policy.max_depth))
+    thinker.submit(int)  # starts the worker now rather than on the first enemy turn
+    return thinker
+
+
+POLICIES = {
+    "random": battle_engine.RandomPolicy,
+    "search": SearchPolicy
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Random hero against the random and the search enemy, headless.")
+    parser.add_argument("count", type=int, nargs="?", default=20)
+    parser.add_argument("--budget-ms", type=int, default=BUDGET_MS)
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE)
+    args = parser.parse_args()
+
+    for enemy in (atr.visor_attributes, atr.dunky_attributes):
+        for name in POLICIES:
+            policy = SearchPolicy(args.budget_ms, args.cache_size) if name == "search" else POLICIES[name]()
+            rng = random.Random(0)
+            wins = 0
+            for i in range(args.count):
+                battle = battle_engine.simulate_battle(atr.meepo_attributes, enemy, rng, enemy_policy=policy)
+                wins += battle.winner() is battle.character2
+            line = f"{enemy['name']:<6} {name:<6} enemy wins {wins}/{args.count}"
+            if name == "search":
+                line += f", {policy.summary()}"
+            print(line)
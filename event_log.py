@@ -0,0 +1,166 @@
+import os
+import struct
+import sys
+import combat_log
+
+# Per-turn event stream. Battle packs every event into a fixed-size ring buffer as it
+# happens and the buffer is written to combat_log.events in batches, so memory stays
+# flat however long a session runs. Without a path the ring only keeps the latest
+# events and overwrites the oldest ones.
+#
+# combat_log.events uses the same 4 KiB JSON header as combat_log.bin, with its own
+# name and move tables, followed by 32-byte records. In every record, actor is the
+# character the event is about and opponent is the character it is fighting:
+#   START   the battle begins
+#   ACTION  actor has finished a move (written after the move, so the hp/mana are after it)
+#   DAMAGE  actor lost amount hp
+#   PARRY   actor parried, amount ms after the parry window opened
+#   END     the battle is over, move holds actor's result code and amount the
+#           combat_log.bin battle id (-1 when the battle was not logged)
+
+EVENT_FILE = "combat_log.events"
+MAGIC = b"SNEV"
+RECORD_FORMAT = "<IIIHBBBBihhhh2x"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+NO_MOVE = 255
+
+START, ACTION, DAMAGE, PARRY, END = range(5)
+KINDS = ["start", "action", "damage", "parry", "end"]
+
+
+def event_dtype():
+    import numpy as np
+    return np.dtype([
+        ("session", "<u4"), ("battle", "<u4"), ("time_ms", "<u4"), ("turn", "<u2"),
+        ("kind", "u1"), ("actor", "u1"), ("opponent", "u1"), ("move", "u1"), ("amount", "<i4"),
+        ("actor_hp", "<i2"), ("opponent_hp", "<i2"), ("actor_mana", "<i2"), ("opponent_mana", "<i2"),
+        ("pad", "V2")
+    ])
+
+
+def clamp16(value):
+    return max(-32768, min(32767, value))
+
+
+class EventLog:
+    def __init__(self, path=EVENT_FILE, capacity=4096):
+        self.path = path
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD_SIZE)
+        self.head = 0
+        self.size = 0
+        self.dropped = 0
+        self.written = 0
+        self.session = int.from_bytes(os.urandom(4), "little")
+        self.battles = 0
+        if path and os.path.exists(path):
+            self.header = combat_log.read_header(path, MAGIC)
+        else:
+            self.header = combat_log.new_header()
+
+    def begin_battle(self):
+        self.battles += 1
+        return self.battles
+
+    def emit(self, battle_id, time_ms, turn, kind, actor, opponent, move=None, amount=0):
+        if move is None:
+            move_code = NO_MOVE
+        elif isinstance(move, int):
+            move_code = move  # END carries a result code, not a move name
+        else:
+            move_code = combat_log.code_for(self.header["moves"], move)
+        struct.pack_into(RECORD_FORMAT, self.buffer, self.head * RECORD_SIZE,
+                         self.session, battle_id, max(0, time_ms) & 0xFFFFFFFF, min(turn, 0xFFFF), kind,
+                         combat_log.code_for(self.header["names"], actor.name),
+                         combat_log.code_for(self.header["names"], opponent.name), move_code, amount,
+                         clamp16(actor.health), clamp16(opponent.health),
+                         clamp16(actor.mana), clamp16(opponent.mana))
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+        else:
+            self.dropped += 1
+        if self.path and self.size == self.capacity:
+            self.flush()
+
+    def pending(self):
+        """The buffered records, oldest first."""
+        start = (self.head - self.size) % self.capacity
+        end = start + self.size
+        if end <= self.capacity:
+            return bytes(self.buffer[start * RECORD_SIZE:end * RECORD_SIZE])
+        return bytes(self.buffer[start * RECORD_SIZE:]) + bytes(self.buffer[:(end - self.capacity) * RECORD_SIZE])
+
+    def flush(self):
+        """Appends the buffered events to the file; returns how many were written."""
+        if not self.path or not self.size:
+            return 0
+        data = self.pending()
+        with combat_log.locked(self.path):
+            self.append(data)
+        count = self.size
+        self.written += count
+        self.head = 0
+        self.size = 0
+        return count
+
+    def append(self, data):
+        if os.path.exists(self.path):
+            disk = combat_log.read_header(self.path, MAGIC)
+        else:
+            disk = combat_log.new_header()
+            with open(self.path, "wb") as file:
+                file.write(combat_log.encode_header(disk, MAGIC))
+        tables_before = len(disk["names"]), len(disk["moves"])
+        # another session may have added names since we read the header
+        name_map = [combat_log.code_for(disk["names"], name) for name in self.header["names"]]
+        move_map = [combat_log.code_for(disk["moves"], move) for move in self.header["moves"]]
+        if name_map != list(range(len(name_map))) or move_map != list(range(len(move_map))):
+            data = remap(data, name_map, move_map)
+        with open(self.path, "r+b") as file:
+            if (len(disk["names"]), len(disk["moves"])) != tables_before:
+                file.write(combat_log.encode_header(disk, MAGIC))
+            file.truncate(combat_log.HEADER_SIZE + combat_log.record_count(self.path, RECORD_SIZE) * RECORD_SIZE)
+            file.seek(0, os.SEEK_END)
+            file.write(data)
+        self.header = disk
+
+    def close(self):
+        self.flush()
+
+
+def remap(data, name_map, move_map):
+    out = bytearray(data)
+    for offset in range(0, len(out), RECORD_SIZE):
+        fields = list(struct.unpack_from(RECORD_FORMAT, out, offset))
+        fields[5] = name_map[fields[5]]
+        fields[6] = name_map[fields[6]]
+        if fields[7] != NO_MOVE and fields[4] != END:
+            fields[7] = move_map[fields[7]]
+        struct.pack_into(RECORD_FORMAT, out, offset, *fields)
+    return bytes(out)
+
+
+def describe(header, event):
+    names = header["names"]
+    if event["kind"] == END:
+        move = combat_log.RESULTS.get(int(event["move"]), "Unknown")
+    else:
+        move = "" if event["move"] == NO_MOVE else header["moves"][event["move"]]
+    return (f"{event['session']:08x}/{event['battle']} t={event['time_ms']}ms turn {event['turn']} "
+            f"{KINDS[event['kind']]:<6} {names[event['actor']]} vs {names[event['opponent']]} "
+            f"{move} {event['amount']} hp {event['actor_hp']}/{event['opponent_hp']} "
+            f"mana {event['actor_mana']}/{event['opponent_mana']}")
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else EVENT_FILE
+    last = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    if not os.path.exists(path):
+        print(f"{path} does not exist yet, play a battle first")
+        sys.exit(1)
+    count = combat_log.record_count(path, RECORD_SIZE)
+    print(f"{path}: {count} events")
+    header = combat_log.read_header(path, MAGIC)
+    for event in combat_log.open_records(path, max(0, count - last), dtype=event_dtype()):
+        print(describe(header, event))
@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import random
+import sys
+import attribute as atr
+
+# Fixed-timestep clock for the battle screen. The simulation (Battle.update and the
+# sprite animation clocks, which open and close the parry windows) always moves in
+# STEP_MS steps of simulated time, and the battle's clock reads that simulated time.
+# Each drawn frame runs as many steps as real time has moved on since the last one and
+# is then rendered part of the way into the next step. How often the screen is drawn
+# only changes how much of the battle you see, not how long anything in it takes: an
+# animation frame, a parry window or the enemy's turn delay is as long at 30 fps as at
+# 144 fps.
+
+STEP_MS = 5
+# a longer frame (a stall, the window being dragged) is not caught up on; the battle
+# pauses for the rest of it instead of running the parry window by unseen
+MAX_FRAME_MS = 100
+# frame times are counted in a fixed histogram of PACING_BIN_MS bins, so a long session
+# (or the --worker process, which keeps its game open) uses the same memory as a short one
+PACING_BIN_MS = 0.1
+PACING_BINS = 5000
+# how long a sprite frame stays up: the old 5 drawn frames per sprite frame at 60 fps
+ANIMATION_FRAME_MS = 5 * 1000 / 60
+# animation -> (sprite frame the parry window opens on, sprite frame it closes on)
+PARRY_WINDOWS = {
+    "attack": (2, 4),
+    "smoke": (2, 10),
+    "fireball": (2, 10)
+}
+
+
+class FixedTimestep:
+    def __init__(self, step_ms=STEP_MS, max_frame_ms=MAX_FRAME_MS):
+        self.step_ms = step_ms
+        self.max_frame_ms = max_frame_ms
+        self.now = 0
+        self.accumulator = 0.0
+        self.paused_ms = 0.0
+
+    def clock(self):
+        """Simulated milliseconds, for Battle(clock=...)."""
+        return self.now
+
+    def steps(self, frame_ms):
+        """Yields once per step that is due after frame_ms of real time, with the
+        clock already moved to the end of that step."""
+        if frame_ms > self.max_frame_ms:
+            self.paused_ms += frame_ms - self.max_frame_ms
+            frame_ms = self.max_frame_ms
+        self.accumulator += frame_ms
+        while self.accumulator >= self.step_ms:
+            self.accumulator -= self.step_ms
+            self.now += self.step_ms
+            yield self.now
+
+    def alpha(self):
+        """How far into the next step the frame being drawn is, 0 to 1."""
+        return self.accumulator / self.step_ms
+
+
+class AnimationClock:
+    """The sprite frame an animation is on, worked out from the simulated time since
+    it started instead of from how many frames were drawn."""
+
+    def __init__(self):
+        self.name = None
+        self.elapsed = 0
+        self.length = 0
+
+    def start(self, name, length):
+        self.name = name
+        self.elapsed = 0
+        self.length = length
+
+    def stop(self):
+        self.name = None
+        self.elapsed = 0
+
+    def frame(self, ahead_ms=0):
+        if self.name is None:
+            return 0
+        return min(self.length - 1, int((self.elapsed + ahead_ms) // ANIMATION_FRAME_MS))
+
+    def advance(self, ms):
+        """Moves on by ms; returns (frames passed before, frames passed after), which is
+        the same pair however ms was split up, and stops at the end of the animation."""
+        before = int(self.elapsed // ANIMATION_FRAME_MS)
+        self.elapsed += ms
+        after = int(self.elapsed // ANIMATION_FRAME_MS)
+        if after >= self.length:
+            self.stop()
+        return before, after
+
+
+def parry_window_edges(animation, before, after):
+    """(opens, closes) for an animation that went from sprite frame before to after."""
+    window = PARRY_WINDOWS.get(animation)
+    if window is None or before == after:
+        return False, False
+    return before < window[0] <= after, before < window[1] <= after
+
+
+class FramePacing:
+    """Real frame times against the target rate, and what the simulation made of them."""
+
+    def __init__(self, target_fps):
+        self.target_ms = 1000 / target_fps
+        self.histogram = [0] * PACING_BINS
+        self.count = 0
+        self.real_ms = 0.0
+        self.max_ms = 0.0
+        self.late = 0
+        self.steps = 0
+        self.max_steps = 0
+
+    def frame(self, frame_ms, steps):
+        self.histogram[min(PACING_BINS - 1, int(frame_ms / PACING_BIN_MS))] += 1
+        self.count += 1
+        self.real_ms += frame_ms
+        self.max_ms = max(self.max_ms, frame_ms)
+        if frame_ms > 1.5 * self.target_ms:
+            self.late += 1
+        self.steps += steps
+        self.max_steps = max(self.max_steps, steps)
+
+    def percentile(self, p):
+        """Frame time at percentile p, to within a histogram bin."""
+        rank = min(self.count - 1, int(p * self.count))
+        seen = 0
+        for index, frames in enumerate(self.histogram):
+            seen += frames
+            if seen > rank:
+                return min(self.max_ms, (index + 0.5) * PACING_BIN_MS)
+        return self.max_ms
+
+    def summary(self, timestep=None, inputs=None):
+        if not self.count:
+            return "frame pacing: no frames"
+        count = self.count
+        line = (f"frame pacing: {count} frames, {1000 * count / max(self.real_ms, 1e-9):.1f} fps "
+                f"(target {1000 / self.target_ms:.0f}), frame ms p50 {self.percentile(0.5):.1f} "
+                f"p95 {self.percentile(0.95):.1f} p99 {self.percentile(0.99):.1f} max {self.max_ms:.1f}, "
+                f"{self.late} frames over 1.5x the target, {self.steps / count:.2f} steps per frame "
+                f"(max {self.max_steps})")
+        if timestep is not None:
+            line += f", {timestep.now} ms simulated, {timestep.paused_ms:.0f} ms paused"
+        if inputs:
+            windows = parry_windows(inputs)
+            if windows:
+                line += f", parry windows {min(windows)}-{max(windows)} ms ({len(windows)})"
+        return line
+
+
+def parry_windows(inputs):
+    """Lengths of the parry windows in a Battle's recorded inputs, in simulated ms."""
+    windows = []
+    opened = None
+    for tick, kind, *_ in inputs:
+        if kind == "open":
+            opened = tick
+        elif kind == "close" and opened is not None:
+            windows.append(tick - opened)
+            opened = None
+    return windows
+
+
+def pacing_check(fps_list, seed=0, turns=20, jitter=0.3):
+    """Plays the same seeded battle through the battle screen's step loop at each frame
+    rate, headless, with jittered frame times; returns {fps: (pacing, timestep, battle)}."""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import pygame
+    from battle_engine import Battle, Character
+    from combat_turn_based import CharacterSprite
+    pygame.init()
+    pygame.display.set_mode((1, 1), pygame.HIDDEN)
+    results = {}
+    for fps in fps_list:
+        frames = random.Random(seed)
+        timestep = FixedTimestep()
+        hero, enemy = Character(atr.meepo_attributes), Character(atr.visor_attributes)
+        sprites = [CharacterSprite(hero, atr.meepo_attributes), CharacterSprite(enemy, atr.visor_attributes)]
+        battle = Battle(hero, enemy, clock=timestep.clock, seed=seed, record=True)
+        pacing = FramePacing(fps)
+        moves = random.Random(seed)
+        while not battle.game_over and battle.turns < 2 * turns:
+            # the hero waits for the last move to play out, the way a player would
+            if battle.is_character1_turn and not any(sprite.is_animating for sprite in sprites):
+                move_type, choice = hero.choose_move(moves) or ("attack", None)
+                battle.process_action(move_type, ability_choice=choice if move_type == "ability" else None,
+                                      item_choice=choice if move_type == "item" else None)
+            frame_ms = 1000 / fps * (1 + frames.uniform(-jitter, jitter))
+            steps = 0
+            for _ in timestep.steps(frame_ms):
+                battle.update()
+                for sprite in sprites:
+                    sprite.animate(battle, timestep.step_ms)
+                steps += 1
+            pacing.frame(frame_ms, steps)
+        results[fps] = pacing, timestep, battle
+    pygame.quit()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play one battle at several frame rates and compare its timing.")
+    parser.add_argument("fps", type=int, nargs="*", default=[30, 60, 144])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--jitter", type=float, default=0.3, help="frame times vary by up to this fraction")
+    args = parser.parse_args()
+
+    import replay
+    results = pacing_check(args.fps, args.seed, args.turns, args.jitter)
+    for fps, (pacing, timestep, battle) in results.items():
+        print(f"{fps:>4} fps: {pacing.summary(timestep, battle.inputs)}")
+    outcomes = {json.dumps(replay.final_state(battle)) for _, _, battle in results.values()}
+    print("same battle at every frame rate" if len(outcomes) == 1 else "the battles came out differently")
+    sys.exit(0 if len(outcomes) == 1 else 1)
@@ -0,0 +1,81 @@
+import pygame
+
+# Retained HUD widgets: text is rendered once and only re-rendered when the value
+# behind it changes, and buttons keep a fixed rect that input is hit-tested against.
+
+
+class Label:
+    def __init__(self, font, color, pos, anchor="topleft"):
+        self.font = font
+        self.color = color
+        self.pos = pos
+        self.anchor = anchor
+        self.text = None
+        self.surface = None
+        self.rect = pygame.Rect(pos, (0, 0))
+
+    def set_text(self, text, color=None):
+        color = color or self.color
+        if text == self.text and color == self.color:
+            return False
+        self.text = text
+        self.color = color
+        self.surface = self.font.render(text, True, color)
+        self.rect = self.surface.get_rect(**{self.anchor: self.pos})
+        return True
+
+    def draw(self, screen):
+        if self.surface:
+            screen.blit(self.surface, self.rect)
+
+
+class Button:
+    def __init__(self, key, text, rect, font, color, text_color, caption=None, caption_font=None,
+                 caption_color=None):
+        self.key = key
+        self.rect = pygame.Rect(rect)
+        self.color = color
+        self.label = Label(font, text_color, self.rect.center, anchor="center")
+        self.label.set_text(text)
+        self.caption = None
+        if caption:
+            self.caption = Label(caption_font, caption_color, (self.rect.centerx, self.rect.y + 65), anchor="midtop")
+            self.caption.set_text(caption)
+
+    def bounds(self):
+        if self.caption:
+            return self.rect.union(self.caption.rect)
+        return self.rect
+
+    def draw(self, screen):
+        pygame.draw.rect(screen, self.color, self.rect)
+        self.label.draw(screen)
+        if self.caption:
+            self.caption.draw(screen)
+
+
+class Hud:
+    def __init__(self):
+        self.groups = {}
+        self.visible = []
+
+    def add(self, group, button):
+        self.groups.setdefault(group, []).append(button)
+        return button
+
+    def show(self, *groups):
+        self.visible = [group for group in groups if group in self.groups]
+
+    def visible_buttons(self):
+        for group in self.visible:
+            yield from self.groups[group]
+
+    def button_at(self, pos):
+        for button in self.visible_buttons():
+            if button.rect.collidepoint(pos):
+                return button.key
+        return None
+
+    def draw(self, screen):
+        for button in self.visible_buttons():
+            button.draw(screen)
@@ -0,0 +1,417 @@
+import os
+import sys
+import threading
+import numpy as np
+import combat_log
+
+STATS = ["Damage Dealt", "Healing Done", "Damage Mitigated"]
+FIELDS = ["damage_dealt", "healing_done", "damage_mitigated"]
+INDEX_VERSION = 3
+RESULT_NAMES = ["losses", "wins", "draws", "unknown"]
+# result code -> column of RESULT_NAMES; anything unexpected counts as unknown
+RESULT_SLOTS = np.full(256, 3, dtype=np.intp)
+RESULT_SLOTS[[combat_log.LOSS, combat_log.WIN, combat_log.DRAW]] = [0, 1, 2]
+
+
+def index_path(log_path):
+    return os.path.splitext(log_path)[0] + ".agg.npz"
+
+
+def history_path(log_path):
+    return os.path.splitext(log_path)[0] + ".history.npz"
+
+
+def series_path(path, code):
+    """Raw little-endian int64 rows of one character's series, next to the index at path."""
+    return f"{os.path.splitext(path)[0]}.{code}.series"
+
+
+def read_series(path, code, rows):
+    return np.fromfile(series_path(path, code), dtype="<i8", count=rows * len(FIELDS)).reshape(rows, len(FIELDS))
+
+
+def moves_frame(records, exploded, names, move_names):
+    """Long-format (battle, character, turn, move) table for records, from their
+    explode_moves arrays."""
+    import pandas as pd
+    record_index, turn_index, codes = exploded
+    return pd.DataFrame({
+        "battle": np.asarray(records["battle_id"])[record_index],
+        "character": pd.Categorical.from_codes(np.asarray(records["name"])[record_index], categories=names),
+        "turn": turn_index.astype(np.int32),
+        "move": pd.Categorical.from_codes(codes, categories=move_names)
+    })
+
+
+class CombatAggregates:
+    """Materialized per-character totals, opponent counts and battle series.
+
+    The index remembers how many records of the live log it has folded in, so
+    refresh() only reads the records appended since then and saves the result next to
+    the log. It starts from the history snapshot of the rotated segments (when there is
+    one), so opening it never costs more than one live segment. Move counts are kept
+    per character like the other totals. The exploded moves table of the live log is
+    only built when build_moves_table() is called (off the Tk thread); the history
+    only keeps its counts.
+
+    The series are not in the npz: each character's is appended to its own raw file and
+    the npz records how many rows of it are committed, so saving after a refresh only
+    writes the new rows and the small totals. A series is only read from its file when
+    it is asked for; its lows and highs are kept with the totals.
+    """
+
+    def __init__(self, log_path=combat_log.LOG_FILE, path=None, history=True):
+        self.log_path = log_path
+        self.path = path or index_path(log_path)
+        self.history_path = history_path(log_path) if history else None
+        # refresh_chunks may run on a loader thread while the window reads
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.clear()
+        if self.history_path:
+            self.load(self.history_path)
+
+    def clear(self):
+        self.records_seen = 0
+        self.first_battle_id = 0
+        self.names = []
+        self.moves = []
+        self.battles = np.zeros(0, dtype=np.int64)
+        self.wins = np.zeros(0, dtype=np.int64)
+        self.totals = np.zeros((0, len(FIELDS)), dtype=np.int64)
+        self.lows = np.zeros((0, len(FIELDS)), dtype=np.int64)
+        self.highs = np.zeros((0, len(FIELDS)), dtype=np.int64)
+        self.opponent_counts = np.zeros((0, 256), dtype=np.int64)
+        self.results = np.zeros((0, 256, len(RESULT_NAMES)), dtype=np.int64)
+        self.history_move_counts = np.zeros((0, 256), dtype=np.int64)
+        self.live_move_counts = np.zeros((0, 256), dtype=np.int64)
+        # code -> arrays of series rows; series_unread[code] = (index path, rows) are
+        # rows still in a file, which come before the parts
+        self.series_parts = {}
+        self.series_unread = {}
+        self.series_cache = {}
+        # code -> rows already in this index's own series files
+        self.series_saved = {}
+        self.moves_parts = None
+
+    def load(self, path=None):
+        path = path or self.path
+        if not os.path.exists(path):
+            return False
+        with np.load(path, allow_pickle=False) as data:
+            if "version" not in data or int(data["version"]) != INDEX_VERSION:
+                return False
+            self.records_seen = int(data["records_seen"])
+            self.first_battle_id = int(data["first_battle_id"])
+            self.names = data["names"].tolist()
+            self.moves = data["moves"].tolist()
+            self.battles = data["battles"]
+            self.wins = data["wins"]
+            self.totals = data["totals"]
+            self.opponent_counts = data["opponent_counts"]
+            self.history_move_counts = data["history_move_counts"]
+            if "live_move_counts" in data and "results" in data:
+                self.live_move_counts = data["live_move_counts"]
+                self.results = data["results"]
+            elif self.records_seen:
+                # an index from before live move counts and results were kept; rebuilt
+                # from the log
+                self.reset()
+                return False
+            else:
+                # a history snapshot from then: its battles' results are unknown
+                self.live_move_counts = np.zeros_like(self.history_move_counts)
+                self.results = np.zeros(self.opponent_counts.shape + (len(RESULT_NAMES),), dtype=np.int64)
+                self.results[:, :, RESULT_NAMES.index("unknown")] = self.opponent_counts
+            if "series_lengths" in data:
+                lengths = {code: int(rows) for code, rows in enumerate(data["series_lengths"]) if rows}
+                self.series_parts = {}
+                self.series_unread = {code: (path, rows) for code, rows in lengths.items()}
+            else:
+                # an index from when the series were kept in the npz
+                lengths = {}
+                self.series_parts = {code: [data[f"series_{code}"]] for code in range(len(self.names))
+                                     if f"series_{code}" in data}
+                self.series_unread = {}
+            self.series_cache = {}
+            if "lows" in data:
+                self.lows = data["lows"]
+                self.highs = data["highs"]
+            else:
+                self.lows, self.highs = self.series_bounds()
+        # loaded from the history snapshot (or an old npz), the rows still have to be
+        # written to this index's files
+        self.series_saved = lengths if path == self.path else {}
+        self.moves_parts = None
+        return True
+
+    def save(self):
+        # series rows first, the npz that commits them last: rows past the stored length
+        # that a crash left behind are cut off by the next save
+        for code in set(self.series_parts) | set(self.series_unread):
+            saved = self.series_saved.get(code, 0)
+            rows = self.series_rows(code)
+            if rows > saved:
+                with open(series_path(self.path, code), "ab") as file:
+                    file.truncate(saved * len(FIELDS) * 8)
+                    for part in self.series_tail(code, saved):
+                        file.write(np.ascontiguousarray(part, dtype="<i8").tobytes())
+                self.series_saved[code] = rows
+        lengths = np.zeros(len(self.names), dtype=np.int64)
+        for code, rows in self.series_saved.items():
+            lengths[code] = rows
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(file, version=INDEX_VERSION, records_seen=self.records_seen,
+                     first_battle_id=self.first_battle_id, names=np.array(self.names, dtype=str),
+                     moves=np.array(self.moves, dtype=str), battles=self.battles, wins=self.wins,
+                     totals=self.totals, lows=self.lows, highs=self.highs, opponent_counts=self.opponent_counts, results=self.results,
+                     history_move_counts=self.history_move_counts, live_move_counts=self.live_move_counts,
+                     series_lengths=lengths)
+        os.replace(tmp_path, self.path)
+
+    def grow(self, size):
+        extra = size - len(self.battles)
+        if extra <= 0:
+            return
+        self.battles = np.concatenate([self.battles, np.zeros(extra, dtype=np.int64)])
+        self.wins = np.concatenate([self.wins, np.zeros(extra, dtype=np.int64)])
+        self.totals = np.concatenate([self.totals, np.zeros((extra, len(FIELDS)), dtype=np.int64)])
+        self.lows = np.concatenate([self.lows, np.full((extra, len(FIELDS)), np.iinfo(np.int64).max)])
+        self.highs = np.concatenate([self.highs, np.full((extra, len(FIELDS)), np.iinfo(np.int64).min)])
+        self.opponent_counts = np.concatenate([self.opponent_counts, np.zeros((extra, 256), dtype=np.int64)])
+        self.results = np.concatenate([self.results, np.zeros((extra, 256, len(RESULT_NAMES)), dtype=np.int64)])
+        self.history_move_counts = np.concatenate([self.history_move_counts, np.zeros((extra, 256), dtype=np.int64)])
+        self.live_move_counts = np.concatenate([self.live_move_counts, np.zeros((extra, 256), dtype=np.int64)])
+
+    def add(self, records, moves, fold_moves=False):
+        if not len(records):
+            return
+        self.grow(len(self.names))
+        codes = records["name"].astype(np.intp)
+        values = np.stack([records[field].astype(np.int64) for field in FIELDS], axis=1)
+        size = len(self.names)
+        self.battles += np.bincount(codes, minlength=size)
+        self.wins += np.bincount(codes[records["result"] == combat_log.WIN], minlength=size)
+        np.add.at(self.totals, codes, values)
+        np.minimum.at(self.lows, codes, values)
+        np.maximum.at(self.highs, codes, values)
+        np.add.at(self.opponent_counts, (codes, records["opponent"]), 1)
+        np.add.at(self.results, (codes, records["opponent"], RESULT_SLOTS[records["result"]]), 1)
+        exploded = combat_log.explode_moves(records, moves)
+        record_index, _, move_codes = exploded
+        counts = self.history_move_counts if fold_moves else self.live_move_counts
+        np.add.at(counts, (codes[record_index], move_codes), 1)
+        if not fold_moves and self.moves_parts is not None:
+            self.moves_parts.append(moves_frame(records, exploded, self.names, self.moves))
+        for code in np.unique(codes):
+            self.series_parts.setdefault(int(code), []).append(values[codes == code])
+            self.series_cache.pop(int(code), None)
+
+    def build_moves_table(self):
+        """Explodes the live log's movesets into the moves table, once.
+
+        Slow on a big log, so the Statistic window calls it on a worker thread. The
+        lock is only held to start the table and to catch up on records folded in
+        while it was being built.
+        """
+        with self.lock:
+            if self.moves_parts is not None:
+                return
+            stop = self.records_seen
+            first_id = self.first_battle_id
+            names, move_names = list(self.names), list(self.moves)
+        records = combat_log.open_records(self.log_path, 0, stop)
+        moves = combat_log.open_moves(self.log_path)
+        part = moves_frame(records, combat_log.explode_moves(records, moves), names, move_names)
+        with self.lock:
+            if self.moves_parts is not None or self.records_seen < stop or self.first_battle_id != first_id:
+                return  # built by someone else, or reset underneath us
+            # parts are concatenated lazily, so folding in many chunks stays linear
+            self.moves_parts = [part]
+            if self.records_seen > stop:
+                records = combat_log.open_records(self.log_path, stop, self.records_seen)
+                exploded = combat_log.explode_moves(records, combat_log.open_moves(self.log_path))
+                self.moves_parts.append(moves_frame(records, exploded, self.names, self.moves))
+
+    def moves_table_ready(self):
+        with self.lock:
+            return self.moves_parts is not None
+
+    def load_moves_table(self):
+        """The long-format (battle, character, turn, move) table of every folded-in move."""
+        import pandas as pd
+        self.build_moves_table()
+        with self.lock:
+            if len(self.moves_parts) > 1:
+                # name and move tables only ever grow, so widening the categories keeps old codes
+                for part in self.moves_parts:
+                    for column, categories in (("character", self.names), ("move", self.moves)):
+                        part[column] = part[column].cat.set_categories(categories)
+                self.moves_parts = [pd.concat(self.moves_parts, ignore_index=True)]
+            return self.moves_parts[0]
+
+    def refresh(self):
+        """Folds in whatever was appended to the log; returns the number of new records."""
+        added = 0
+        for chunk, _, _ in self.refresh_chunks(chunk_records=None):
+            added += chunk
+        return added
+
+    def refresh_chunks(self, chunk_records=1 << 15):
+        """refresh() a chunk at a time, yielding (records added, records folded in, log size).
+
+        Closing the generator early is safe: what was folded in so far is saved and
+        the next refresh carries on from there.
+        """
+        if not self.records_seen:
+            with self.lock:
+                self.load()
+        if not os.path.exists(self.log_path):
+            return
+        header, count = combat_log.snapshot(self.log_path)
+        first_id = header.get("first_battle_id", 0)
+        if first_id != self.first_battle_id and combat_log.list_segments(self.log_path):
+            # the log was rotated since this index was built
+            compact_history(self.log_path)
+        with self.lock:
+            if (first_id != self.first_battle_id or count < self.records_seen
+                    or header["names"][:len(self.names)] != self.names):
+                # rotated, replaced or truncated underneath us: start over from the history
+                self.reset()
+                self.first_battle_id = first_id
+            if count == self.records_seen:
+                return
+            self.names = list(header["names"])
+            self.moves = list(header["moves"])
+        moves = combat_log.open_moves(self.log_path)
+        try:
+            while self.records_seen < count:
+                stop = count if chunk_records is None else min(count, self.records_seen + chunk_records)
+                records = combat_log.open_records(self.log_path, self.records_seen, stop)
+                if combat_log.read_header(self.log_path).get("first_battle_id", 0) != first_id:
+                    break  # rotated while we were reading; the next refresh starts over
+                with self.lock:
+                    self.add(records, moves)
+                    added = stop - self.records_seen
+                    self.records_seen = stop
+                yield added, stop, count
+        finally:
+            # two windows on one log share the index; its series files are appended in place
+            with self.lock, combat_log.locked(self.path):
+                self.save()
+
+    def series_array(self, code):
+        array = self.series_cache.get(code)
+        if array is None:
+            parts = self.series_parts.get(code, [])
+            if code in self.series_unread:
+                path, rows = self.series_unread.pop(code)
+                parts = [read_series(path, code, rows)] + parts
+            array = np.concatenate(parts) if parts else np.zeros((0, len(FIELDS)), dtype=np.int64)
+            self.series_parts[code] = [array]
+            self.series_cache[code] = array
+        return array
+
+    def series_rows(self, code):
+        return self.series_unread.get(code, (None, 0))[1] + sum(len(part) for part in self.series_parts.get(code, []))
+
+    def series_tail(self, code, start):
+        """The parts holding code's series from row start on; only reads the file when
+        the rows wanted are in it."""
+        if start < self.series_unread.get(code, (None, 0))[1]:
+            return [self.series_array(code)[start:]]
+        offset = self.series_unread.get(code, (None, 0))[1]
+        tail = []
+        for part in self.series_parts.get(code, []):
+            if offset + len(part) > start:
+                tail.append(part[max(0, start - offset):])
+            offset += len(part)
+        return tail
+
+    def series_bounds(self):
+        """(lows, highs) worked out from the series, for an index saved before they were kept."""
+        lows = np.full(self.totals.shape, np.iinfo(np.int64).max, dtype=np.int64)
+        highs = np.full(self.totals.shape, np.iinfo(np.int64).min, dtype=np.int64)
+        for code in set(self.series_parts) | set(self.series_unread):
+            series = self.series_array(code)
+            if len(series):
+                lows[code] = series.min(axis=0)
+                highs[code] = series.max(axis=0)
+        return lows, highs
+
+    def characters(self):
+        with self.lock:
+            return [name for code, name in enumerate(self.names) if code < len(self.battles) and self.battles[code]]
+
+    def series(self, name, stat):
+        with self.lock:
+            return self.series_array(self.names.index(name))[:, STATS.index(stat)]
+
+    def move_frequencies(self, name):
+        """(move, count) pairs, most used first."""
+        with self.lock:
+            code = self.names.index(name)
+            return self.ranked_moves(self.history_move_counts[code] + self.live_move_counts[code])
+
+    def table_frequencies(self, name):
+        """move_frequencies() counted from the moves table, plus the history's counts (the
+        history keeps no table); call build_moves_table() first."""
+        with self.lock:
+            table = self.load_moves_table()
+            live = table.loc[table["character"] == name, "move"].value_counts()
+            row = self.history_move_counts[self.names.index(name)].copy()
+            row[:len(self.moves)] += live.reindex(self.moves, fill_value=0).to_numpy()
+            return self.ranked_moves(row)
+
+    def ranked_moves(self, row):
+        order = np.argsort(-row[:len(self.moves)], kind="stable")
+        return [(self.moves[code], int(row[code])) for code in order if row[code]]
+
+    def opponent_frequencies(self, name):
+        with self.lock:
+            row = self.opponent_counts[self.names.index(name)]
+            order = np.argsort(-row[:len(self.names)], kind="stable")
+            return [(self.names[code], int(row[code])) for code in order if row[code]]
+
+
+def compact_history(log_path=combat_log.LOG_FILE, prune=False):
+    """Folds rotated segments the history snapshot does not cover yet into it.
+
+    The snapshot keeps the per-character aggregates, move counts and per-battle stat
+    series of every segment. With prune the folded segment files are deleted.
+    Returns the number of segments folded in.
+    """
+    snapshot = CombatAggregates(log_path, path=history_path(log_path), history=False)
+    folded = 0
+    with combat_log.locked(snapshot.path):
+        snapshot.load()
+        for first_id, segment in combat_log.list_segments(log_path):
+            if first_id >= snapshot.first_battle_id:
+                header = combat_log.read_header(segment)
+                snapshot.names = list(header["names"])
+                snapshot.moves = list(header["moves"])
+                records = combat_log.open_records(segment)
+                snapshot.add(records, combat_log.open_moves(segment), fold_moves=True)
+                snapshot.first_battle_id = first_id + len(records) // 2
+                del records
+                folded += 1
+            if prune:
+                os.remove(segment)
+                if os.path.exists(combat_log.moves_path(segment)):
+                    os.remove(combat_log.moves_path(segment))
+        if folded:
+            snapshot.save()
+    return folded
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "compact":
+        args = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+        log = args[0] if args else combat_log.LOG_FILE
+        count = compact_history(log, prune="--prune" in sys.argv)
+        print(f"Folded {count} segments of {log} into {history_path(log)}")
+    else:
+        print("usage: python log_aggregates.py compact [log] [--prune]")
@@ -1,25 +1,98 @@
+import startup_profile
 import tkinter as tk
+from tkinter import messagebox
 import os
 import subprocess
 import sys
 import threading
-import pygame
-from PIL import Image, ImageTk
+import time
+with startup_profile.step("import pygame"):
+    import pygame
+with startup_profile.step("import PIL"):
+    from PIL import Image, ImageTk
+import sound_bank
+
+class BattleWorker:
+    """Keeps one pre-warmed combat_turn_based.py --worker process alive for the menu.
+
+    The worker has pygame, fonts, the background and every sprite and sound loaded
+    before the first click, so starting a stage is a single line over its stdin.
+    """
+
+    def __init__(self, script_path, on_done):
+        self.on_done = on_done
+        self.ready = threading.Event()
+        self.busy = False
+        self.level = None
+        self.clicked_at = None
+        self.spawned_at = time.perf_counter()
+        env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT="1")
+        command = [sys.executable, script_path, "--worker"]
+        if startup_profile.enabled():
+            command.append(startup_profile.FLAG)
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, text=True, bufsize=1, env=env)
+        threading.Thread(target=self.read_replies, daemon=True).start()
+
+    def read_replies(self):
+        for line in self.process.stdout:
+            line = line.rstrip("\n")
+            if line == "@ready":
+                print(f"Battle worker ready after {(time.perf_counter() - self.spawned_at) * 1000:.0f} ms")
+                self.ready.set()
+            elif line == "@frame":
+                elapsed = (time.perf_counter() - self.clicked_at) * 1000
+                print(f"Stage {self.level}: first battle frame {elapsed:.0f} ms after click")
+            elif line == "@done":
+                self.busy = False
+                self.on_done()
+            else:
+                print(line)
+        self.ready.clear()
+        if self.busy:
+            self.busy = False
+            self.on_done()
+
+    def available(self):
+        return self.ready.is_set() and not self.busy and self.process.poll() is None
+
+    def start(self, level):
+        self.busy = True
+        self.level = level
+        self.clicked_at = time.perf_counter()
+        self.process.stdin.write(f"start {level}\n")
+        self.process.stdin.flush()
+
+    def stop(self):
+        try:
+            self.process.stdin.write("quit\n")
+            self.process.stdin.flush()
+            self.process.wait(timeout=2)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            self.process.terminate()
+            self.process.wait()
+
 
 class BaseMenu(tk.Tk):
     def __init__(self, title):
-        super().__init__()
-        pygame.mixer.init()
+        with startup_profile.step("tk root"):
+            super().__init__()
+        with startup_profile.step("pygame.mixer.init"):
+            pygame.mixer.init()
         self.title(title)
         self.geometry("1280x720")
         self.resizable(False, False)
         self.protocol("WM_DELETE_WINDOW", self.quit_game)
         self.game_process = None
+        with startup_profile.step("spawn battle worker"):
+            self.battle_worker = self.start_battle_worker()
         self.sfx_path = "sfx/menu"
-        self.sounds = self.load_sounds()
+        with startup_profile.step("menu sounds"):
+            self.sounds = self.load_sounds()
         try:
-            self.bg_image = Image.open("bg.png")
-            self.bg_photo = ImageTk.PhotoImage(self.bg_image)
+            with startup_profile.step("background"):
+                self.bg_image = Image.open("bg.png")
+                self.bg_photo = ImageTk.PhotoImage(self.bg_image)
         except FileNotFoundError:
             self.bg_photo = None
             print("Warning: bg.png not found.")
@@ -31,13 +104,10 @@ class BaseMenu(tk.Tk):
         pygame.mixer.music.play(-1)
 
     def load_sound(self, path):
-        try:
-            sound = pygame.mixer.Sound(path)
+        sound = sound_bank.load_sound(path)
+        if sound:
             print(f"Loaded sound: {path}")
-            return sound
-        except pygame.error as e:
-            print(f"Error loading sound ({path}): {e}")
-            return None
+        return sound
 
     def load_sounds(self):
         sounds = {}
@@ -48,6 +118,7 @@ class BaseMenu(tk.Tk):
                 sounds[key] = self.load_sound(path)
             else:
                 print(f"Warning: Sound file not found at {path}")
+        print(sound_bank.report())
         return sounds
 
     def play_sound(self, sound_key):
@@ -55,6 +126,22 @@ class BaseMenu(tk.Tk):
         if sound:
             sound.play()
 
+    def start_battle_worker(self):
+        script_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "combat_turn_based.py")
+        try:
+            return BattleWorker(script_path, on_done=lambda: self.after(0, self.deiconify))
+        except OSError as e:
+            print(f"Could not start battle worker, stages will launch a new process: {e}")
+            return None
+
+    def start_level(self, level):
+        if self.battle_worker and self.battle_worker.available():
+            pygame.mixer.music.stop()
+            self.withdraw()
+            self.battle_worker.start(level)
+        else:
+            self.run_script("combat_turn_based.py", level)
+
     def run_script(self, script_name, *args):
         try:
             current_directory = os.path.dirname(os.path.realpath(__file__))
@@ -68,6 +155,8 @@ class BaseMenu(tk.Tk):
                     pygame.mixer.music.stop()
                     self.withdraw()
                     command = [sys.executable, script_path] + [str(arg) for arg in args]
+                    if startup_profile.enabled():
+                        command.append(startup_profile.FLAG)
                     self.game_process = subprocess.Popen(command)
                     self.game_process.wait()
                     self.deiconify()
@@ -80,15 +169,18 @@ class BaseMenu(tk.Tk):
             threading.Thread(target=run_process).start()
 
         except Exception as e:
-            tk.messagebox.showerror("Error", f"Could not launch {script_name}: {e}")
+            messagebox.showerror("Error", f"Could not launch {script_name}: {e}")
             print(f"Error in run_script for {script_name}: {e}")
 
     def quit_game(self):
         pygame.mixer.music.stop()
+        sound_bank.clear_sounds()
         pygame.mixer.quit()
         if self.game_process:
             self.game_process.terminate()
             self.game_process.wait()
+        if self.battle_worker:
+            self.battle_worker.stop()
         self.destroy()
 
 class StarryNightMainMenu(BaseMenu):
@@ -115,8 +207,8 @@ class StarryNightMainMenu(BaseMenu):
         self.withdraw()
         stage_selection_window = StageSelection(self)
         self.wait_window(stage_selection_window)
-        self.deiconify()
         if not stage_selection_window.started_game:
+            self.deiconify()
             pygame.mixer.music.play(-1)
 
 class StageSelection(tk.Toplevel):
@@ -171,7 +263,7 @@ class StageSelection(tk.Toplevel):
 
     def start_game(self, lvl):
         self.started_game = True
-        self.parent.run_script("combat_turn_based.py", lvl)
+        self.parent.start_level(lvl)
         self.destroy()
 
     def go_back(self):
@@ -180,4 +272,5 @@ class StageSelection(tk.Toplevel):
 
 if __name__ == "__main__":
     app = StarryNightMainMenu()
+    app.after_idle(startup_profile.report, "main_menu.py")
     app.mainloop()
\ No newline at end of file
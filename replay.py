@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+import attribute as atr
+import combat_log
+from battle_engine import Battle, Character, RandomPolicy, ENEMY_TURN_DELAY_MS
+
+# Recorded battles, one JSON object per line of combat_replays.jsonl: the two
+# characters' attribute dicts, the battle's rng seed, the enemy policy, the start
+# tick, every input Battle.record_input kept ([tick, kind, ...]) and the final state.
+# A replay feeds the inputs back in order with the clock set to each input's tick, no
+# delays and no pygame, then checks that the inputs it recorded itself and the final
+# state come out the same. The random enemy is re-drawn from the seed; a policy that
+# cannot be re-run (the search depends on how far it got inside its time budget)
+# plays back its recorded moves instead.
+
+REPLAY_FILE = "combat_replays.jsonl"
+VERSION = 1
+RULE_FIELDS = ["name", "health", "mana", "strength", "defense", "abilities", "items"]
+
+
+class ReplayClock:
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class RecordedPolicy:
+    name = "recorded"
+    background = False
+
+    def __init__(self, inputs):
+        self.moves = iter([tuple(entry[2:]) if entry[2] is not None else None
+                           for entry in inputs if entry[1] == "enemy"])
+
+    def choose(self, actor, opponent, rng=None):
+        return next(self.moves)
+
+
+def rules(attr):
+    return {field: attr[field] for field in RULE_FIELDS}
+
+
+def final_state(battle):
+    winner = battle.winner()
+    return {
+        "turns": battle.turns,
+        "game_over": battle.game_over,
+        "winner": winner.name if winner else None,
+        # the movesets only as their length and checksum, they are most of a battle's size
+        "characters": [{"state": list(char.snapshot()), "moves": zlib.crc32("\n".join(char.moveset).encode())}
+                       for char in (battle.character1, battle.character2)]
+    }
+
+
+def recording(battle, hero_attr, enemy_attr):
+    return {
+        "version": VERSION,
+        "seed": battle.seed,
+        "policy": getattr(battle.enemy_policy, "name", "recorded"),
+        "hero": rules(hero_attr),
+        "enemy": rules(enemy_attr),
+        "start": battle.started_at,
+        "inputs": battle.inputs,
+        "final": final_state(battle)
+    }
+
+
+def save_replays(path, records):
+    lines = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+    with combat_log.locked(path):
+        with open(path, "a") as file:
+            file.write(lines)
+
+
+def save_replay(path, battle, hero_attr, enemy_attr):
+    """Appends a battle that was created with record=True and its own seed."""
+    if battle.inputs is None or battle.seed is None:
+        raise ValueError("only battles created with record=True and a seed can be replayed")
+    save_replays(path, [recording(battle, hero_attr, enemy_attr)])
+
+
+def load_replays(path=REPLAY_FILE):
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def replay(record):
+    """Plays a recording again; returns the replayed Battle."""
+    if record["version"] != VERSION:
+        raise ValueError(f"replay version {record['version']} is not supported")
+    clock = ReplayClock(record["start"])
+    policy = RandomPolicy() if record["policy"] == "random" else RecordedPolicy(record["inputs"])
+    battle = Battle(Character(record["hero"]), Character(record["enemy"]), clock=clock,
+                    seed=record["seed"], enemy_policy=policy, record=True)
+    for tick, kind, *args in record["inputs"]:
+        clock.now = tick
+        if kind == "action":
+            battle.process_action(*args)
+        elif kind == "open":
+            battle.open_parry_window()
+        elif kind == "close":
+            battle.close_parry_window()
+        elif kind == "parry":
+            battle.try_parry()
+        elif kind == "enemy":
+            battle.resolve_enemy_turn()
+        else:
+            raise ValueError(f"unknown input {kind!r}")
+    return battle
+
+
+def verify(record):
+    """What differs between a recording and its replay, empty when nothing does."""
+    battle = replay(record)
+    problems = []
+    # inputs hold only scalars, so they compare equal to their JSON form as they are
+    if battle.inputs != record["inputs"]:
+        first = next((i for i, (a, b) in enumerate(zip(battle.inputs, record["inputs"])) if a != b),
+                     min(len(battle.inputs), len(record["inputs"])))
+        problems.append(f"inputs diverge at #{first}")
+    final = final_state(battle)
+    for key, expected in record["final"].items():
+        if final[key] != expected:
+            problems.append(f"{key}: recorded {expected}, replayed {final[key]}")
+    return problems
+
+
+def play_recorded(hero_attr, enemy_attr, seed, policy=None, max_turns=500):
+    """A headless battle with a random hero and random parry attempts, recorded the way
+    the battle screen records one, for building a regression corpus."""
+    rng = random.Random(~seed)  # the hero's choices and timing, apart from the battle's rng
+    clock = ReplayClock(rng.randrange(1 << 20))
+    battle = Battle(Character(hero_attr), Character(enemy_attr), clock=clock, seed=seed,
+                    enemy_policy=policy, record=True)
+    while not battle.game_over and battle.turns < max_turns:
+        clock.now += rng.randrange(100, 3000)
+        move_type, choice = battle.character1.choose_move(rng) or ("attack", None)
+        if choice is not None:
+            battle.process_action(move_type)  # opening the menu first, like a click does
+        battle.process_action(move_type, ability_choice=choice if move_type == "ability" else None,
+                              item_choice=choice if move_type == "item" else None)
+        if rng.random() < 0.3:
+            clock.now += rng.randrange(50, 400)
+            battle.open_parry_window()
+            if rng.random() < 0.5:
+                clock.now += rng.randrange(0, 300)
+                battle.try_parry()
+            clock.now += rng.randrange(0, 300)
+            battle.close_parry_window()
+        clock.now += ENEMY_TURN_DELAY_MS
+        battle.resolve_enemy_turn()
+    return battle
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-simulate recorded battles and check they come out the same.")
+    parser.add_argument("replays", nargs="?", default=REPLAY_FILE)
+    parser.add_argument("--generate", type=int, metavar="N",
+                        help="first append N recorded headless battles (random hero, random enemy)")
+    parser.add_argument("--seed", type=int, default=0, help="first battle seed for --generate")
+    parser.add_argument("--show", type=int, default=5, help="mismatching battles to print")
+    args = parser.parse_args()
+
+    if args.generate:
+        records = []
+        for i in range(args.generate):
+            enemy = atr.visor_attributes if i % 2 == 0 else atr.dunky_attributes
+            battle = play_recorded(atr.meepo_attributes, enemy, args.seed + i)
+            records.append(recording(battle, atr.meepo_attributes, enemy))
+        save_replays(args.replays, records)
+        print(f"Recorded {len(records)} battles to {args.replays}")
+
+    if not os.path.exists(args.replays):
+        print(f"{args.replays} does not exist yet, play a battle or use --generate")
+        sys.exit(1)
+    start = time.perf_counter()
+    count = failed = 0
+    for index, record in enumerate(load_replays(args.replays)):
+        count += 1
+        problems = verify(record)
+        if problems:
+            failed += 1
+            if failed <= args.show:
+                print(f"battle #{index} (seed {record['seed']}): " + "; ".join(problems))
+    elapsed = time.perf_counter() - start
+    print(f"{count} battles replayed in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.0f} battles/s), "
+          f"{failed} mismatches")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,49 @@
+import os
+import pygame
+
+# One decoded pygame.mixer.Sound per file for the whole process. Characters, the
+# battle screen and the menus all ask the bank, so a WAV shared between them (every
+# roster entry points at sfx/meepo) is decoded into a single buffer.
+_sounds = {}
+
+
+def sound_key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def load_sound(path):
+    key = sound_key(path)
+    if key in _sounds:
+        return _sounds[key]
+    try:
+        sound = pygame.mixer.Sound(path)
+    except pygame.error as e:
+        print(f"Could not load sound ({path}): {e}")
+        sound = None
+    _sounds[key] = sound
+    return sound
+
+
+def loaded_sounds():
+    return {key: sound for key, sound in _sounds.items() if sound is not None}
+
+
+def sound_bytes(sound):
+    init = pygame.mixer.get_init()
+    if not init:
+        return 0
+    frequency, size, channels = init
+    return int(round(sound.get_length() * frequency)) * channels * abs(size) // 8
+
+
+def total_decoded_bytes():
+    return sum(sound_bytes(sound) for sound in loaded_sounds().values())
+
+
+def clear_sounds():
+    _sounds.clear()
+
+
+def report():
+    sounds = loaded_sounds()
+    return f"sound bank: {len(sounds)} sounds, {total_decoded_bytes() / 1024:.0f} KiB decoded"
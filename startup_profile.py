@@ -0,0 +1,41 @@
+import sys
+import time
+from contextlib import contextmanager
+
+# Cold-start timing for the entry points. Pass --startup-profile to main_menu.py,
+# combat_turn_based.py or statistic.py and each import/init step is timed and printed
+# once the first frame (or window) is up. Without the flag every call is a no-op.
+FLAG = "--startup-profile"
+
+_enabled = FLAG in sys.argv
+_started = time.perf_counter()
+_steps = []
+_reported = False
+
+
+def enabled():
+    return _enabled
+
+
+@contextmanager
+def step(name):
+    if not _enabled or _reported:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _steps.append((name, time.perf_counter() - start))
+
+
+def report(label):
+    global _reported
+    if not _enabled or _reported:
+        return
+    _reported = True
+    total = (time.perf_counter() - _started) * 1000
+    print(f"{label} startup profile, {total:.1f} ms since launch:")
+    for name, seconds in _steps:
+        print(f"  {name:<28} {seconds * 1000:8.1f} ms")
+    print(f"  {'other':<28} {total - sum(s for _, s in _steps) * 1000:8.1f} ms")
@@ -1,13 +1,75 @@
-from tkinter import ttk
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import pandas as pd
-import ast
+import startup_profile
+from tkinter import ttk, messagebox
+import combat_log
+from log_aggregates import CombatAggregates, STATS
 import random
 import tkinter as tk
 import os
+import sys
+import math
+import queue
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+
+LOG_POLL_MS = 2000
+LOAD_POLL_MS = 50
+LOAD_REDRAW_S = 0.25
+GRAPH_CACHE_SIZE = 32
+
+# matplotlib is the slowest import in the project; it is pulled in the first time a
+# graph is drawn, through this helper, instead of at import. Figures are created
+# directly rather than through pyplot so nothing is kept in pyplot's figure registry.
+
+
+def load_matplotlib():
+    with startup_profile.step("import matplotlib (TkAgg)"):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+    return Figure, FigureCanvasTkAgg, NavigationToolbar2Tk
+
+
+def downsample(values, start, stop, buckets):
+    """Level of detail for values[start:stop] at roughly one bucket per pixel.
+
+    Returns (x, mean, low, high). When the window already fits in buckets the raw
+    points come back with low and high as None; otherwise every bucket is reduced to
+    its mean, min and max, so the cost of drawing never depends on the history length.
+    """
+    start = max(0, start)
+    stop = min(len(values), stop)
+    window = np.asarray(values[start:stop], dtype=np.float64)
+    if len(window) <= buckets:
+        return np.arange(start, start + len(window)), window, None, None
+    edges = np.linspace(0, len(window), buckets + 1).astype(np.int64)[:-1]
+    counts = np.diff(np.append(edges, len(window)))
+    mean = np.add.reduceat(window, edges) / counts
+    low = np.minimum.reduceat(window, edges)
+    high = np.maximum.reduceat(window, edges)
+    return start + edges + (counts - 1) / 2, mean, low, high
+
+
+class GraphCache:
+    """Least-recently-used store of prepared graph data, keyed by (character, stat, graph type)."""
+
+    def __init__(self, size=GRAPH_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key, build):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        value = build()
+        self.entries[key] = value
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.entries.clear()
 
-import pygame
 
 class StatisticWindow(tk.Tk):
     def __init__(self, previous_window=None):
@@ -18,37 +80,33 @@ class StatisticWindow(tk.Tk):
         self.previous_window = previous_window
         if self.previous_window:
             self.previous_window.destroy()
-        self.canvas_widget = None
-        self.canvas_moveset_widget = None
-        self.canvas_enemy_widget = None
+        self.canvases = {}
+        self.graph_cache = GraphCache()
+        self.stat_series = None
+        self.stat_band = None
         self.selected_graph_type = tk.StringVar()
         self.char_colors = {}
+        self.load_queue = queue.Queue()
+        self.load_cancelled = threading.Event()
+        self.moves_table_thread = None
+        self.protocol("WM_DELETE_WINDOW", self.back_to_main_menu)
         self.init_ui()
 
     def init_ui(self):
-        csv_file = "combat_log.csv"
-        if not os.path.exists(csv_file):
-            tk.messagebox.showerror("Error", f"Could not find {csv_file}. Please play some games to generate data.")
+        log_file = combat_log.LOG_FILE
+        if not os.path.exists(log_file) and not os.path.exists(combat_log.legacy_csv_path(log_file)):
+            messagebox.showerror("Error", f"Could not find {log_file}. Please play some games to generate data.")
             self.destroy()
             return
+        self.aggregates = CombatAggregates(log_file)
 
-        try:
-            self.df = pd.read_csv(csv_file)
-        except Exception as e:
-            tk.messagebox.showerror("Error", f"Error reading {csv_file}: {e}")
-            self.destroy()
-            return
-
-        self.stat_options = ["Damage Dealt", "Healing Done", "Damage Mitigated"]
+        self.stat_options = list(STATS)
         self.selected_stat = tk.StringVar(self)
         self.selected_stat.set(self.stat_options[0])
 
-        self.char_options = self.df["Name"].unique().tolist()
+        # filled in as the loader thread folds the log in
+        self.char_options = []
         self.selected_char = tk.StringVar(self)
-        self.selected_char.set(self.char_options[0])
-
-        for char in self.char_options:
-            self.char_colors[char] = "#{:06x}".format(random.randint(0, 0xFFFFFF))
 
         self.graph_types = ["Statistic", "Moveset", "Enemy", "Table"]
         self.selected_graph_type.set(self.graph_types[0])
@@ -56,12 +114,21 @@ class StatisticWindow(tk.Tk):
         dropdown_frame = ttk.Frame(self)
         dropdown_frame.pack(pady=20)
 
+        self.progress_frame = ttk.Frame(self)
+        self.progress_frame.pack()
+        self.progress_bar = ttk.Progressbar(self.progress_frame, length=400, maximum=1.0)
+        self.progress_bar.pack(side=tk.LEFT, padx=10)
+        self.progress_label = ttk.Label(self.progress_frame, text="Loading combat log...")
+        self.progress_label.pack(side=tk.LEFT, padx=10)
+        self.cancel_button = ttk.Button(self.progress_frame, text="Cancel", command=self.load_cancelled.set)
+        self.cancel_button.pack(side=tk.LEFT, padx=10)
+
         char_label = ttk.Label(dropdown_frame, text="Select Character:")
         char_label.pack(side=tk.LEFT, padx=10)
-        char_dropdown = ttk.Combobox(dropdown_frame, textvariable=self.selected_char,
-                                     values=self.char_options, state="readonly")
-        char_dropdown.pack(side=tk.LEFT, padx=10)
-        char_dropdown.bind("<<ComboboxSelected>>", self.update_graph)
+        self.char_dropdown = ttk.Combobox(dropdown_frame, textvariable=self.selected_char,
+                                          values=self.char_options, state="readonly")
+        self.char_dropdown.pack(side=tk.LEFT, padx=10)
+        self.char_dropdown.bind("<<ComboboxSelected>>", self.update_graph)
 
         stat_label = ttk.Label(dropdown_frame, text="Select Statistic:")
         stat_label.pack(side=tk.LEFT, padx=10)
@@ -91,18 +158,112 @@ class StatisticWindow(tk.Tk):
         self.table_frame = ttk.Frame(self)
         self.table_frame.pack(fill=tk.BOTH, expand=True)
         self.table_frame.pack_forget()
+        self.table = self.build_table()
 
         self.back_button = ttk.Button(self, text="Back to Main Menu", command=self.back_to_main_menu)
         self.back_button.pack(anchor=tk.NE, padx=10, pady=10)
 
+        self.last_redraw = 0
+        threading.Thread(target=self.load_log, daemon=True).start()
+        self.after(LOAD_POLL_MS, self.check_loading)
+        self.after_idle(startup_profile.report, "statistic.py")
+
+    def load_log(self):
+        """Loader thread: folds the log into the aggregates chunk by chunk.
+
+        Tk is only touched from the main thread, so progress goes through load_queue.
+        """
+        try:
+            log_file = self.aggregates.log_path
+            csv_path = combat_log.legacy_csv_path(log_file)
+            if os.path.exists(csv_path):
+                # a no-op once the log's header says the CSV is in
+                self.load_queue.put(("status", f"Migrating {csv_path}..."))
+                combat_log.migrate_csv(log_file)
+            chunks = self.aggregates.refresh_chunks()
+            try:
+                for _, done, total in chunks:
+                    self.load_queue.put(("progress", done, total))
+                    if self.load_cancelled.is_set():
+                        self.load_queue.put(("cancelled", done, total))
+                        return
+            finally:
+                chunks.close()
+            self.load_queue.put(("done",))
+        except Exception as e:
+            self.load_queue.put(("error", e))
+
+    def check_loading(self):
+        try:
+            while True:
+                message = self.load_queue.get_nowait()
+                if message[0] == "status":
+                    self.progress_label.configure(text=message[1])
+                elif message[0] == "progress":
+                    _, done, total = message
+                    self.progress_bar.configure(value=done / total)
+                    self.progress_label.configure(text=f"Loading {done:,} of {total:,} records")
+                    if time.perf_counter() - self.last_redraw >= LOAD_REDRAW_S:
+                        self.show_new_data()
+                elif message[0] == "cancelled":
+                    _, done, total = message
+                    self.show_new_data()
+                    self.progress_label.configure(text=f"Loading cancelled, showing {done:,} of {total:,} records")
+                    self.progress_bar.pack_forget()
+                    self.cancel_button.pack_forget()
+                    return
+                elif message[0] == "done":
+                    self.show_new_data()
+                    self.progress_frame.pack_forget()
+                    self.after(LOG_POLL_MS, self.poll_log)
+                    return
+                elif message[0] == "error":
+                    messagebox.showerror("Error", f"Error reading {self.aggregates.log_path}: {message[1]}")
+                    self.destroy()
+                    return
+        except queue.Empty:
+            pass
+        self.after(LOAD_POLL_MS, self.check_loading)
+
+    def show_new_data(self):
+        for char in self.aggregates.characters():
+            if char not in self.char_colors:
+                self.char_colors[char] = "#{:06x}".format(random.randint(0, 0xFFFFFF))
+        self.char_options = self.aggregates.characters()
+        self.char_dropdown.configure(values=self.char_options)
+        if not self.selected_char.get() and self.char_options:
+            self.selected_char.set(self.char_options[0])
+        self.graph_cache.clear()
         self.update_graph()
+        self.last_redraw = time.perf_counter()
+
+    def poll_log(self):
+        # battles finished while the window is open are folded in and shown
+        if self.aggregates.refresh():
+            self.show_new_data()
+        self.after(LOG_POLL_MS, self.poll_log)
+
+    def graph_canvas(self, graph_type, master, figsize=None, toolbar=False):
+        """The one figure and Tk canvas a graph type is drawn on, created on first use."""
+        if graph_type not in self.canvases:
+            Figure, FigureCanvasTkAgg, NavigationToolbar2Tk = load_matplotlib()
+            figure = Figure(figsize=figsize) if figsize else Figure()
+            canvas = FigureCanvasTkAgg(figure, master=master)
+            if toolbar:
+                # packed before the canvas so the expanding canvas cannot squeeze it out
+                NavigationToolbar2Tk(canvas, master, pack_toolbar=False).pack(side=tk.BOTTOM, fill=tk.X)
+            canvas_widget = canvas.get_tk_widget()
+            canvas_widget.pack(fill=tk.BOTH, expand=True)
+            canvas_widget.configure(background="white")
+            self.canvases[graph_type] = (figure.add_subplot(), canvas)
+        return self.canvases[graph_type]
 
     def update_graph(self, event=None):
-        plt.clf()
-
         selected_stat = self.selected_stat.get()
         selected_char = self.selected_char.get()
         selected_graph_type = self.selected_graph_type.get()
+        if not selected_char:
+            return
 
         self.graph_frame.pack_forget()
         self.moveset_graph_frame.pack_forget()
@@ -123,109 +284,96 @@ class StatisticWindow(tk.Tk):
             self.table_frame.pack(fill=tk.BOTH, expand=True)
 
     def show_statistic_graph(self, selected_char, selected_stat):
-        char_data = self.df[self.df["Name"] == selected_char]
+        ax, canvas = self.graph_canvas("Statistic", self.graph_frame, toolbar=True)
+        char_data = self.graph_cache.get((selected_char, selected_stat, "Statistic"),
+                                         lambda: self.aggregates.series(selected_char, selected_stat))
         color = self.char_colors.get(selected_char, 'gray')
 
-        plt.plot(range(len(char_data)), char_data[selected_stat], marker='o', color=color, label=selected_char)
-        plt.title(f"{selected_char}: {selected_stat} Over Battles")
-        plt.xlabel("Battle Number")
-        plt.ylabel(selected_stat)
-        plt.grid(True)
-        plt.legend()
-
-        canvas = FigureCanvasTkAgg(plt.gcf(), master=self.graph_frame)
-        canvas.draw()
-        canvas_widget = canvas.get_tk_widget()
-
-        if self.canvas_widget:
-            self.canvas_widget.destroy()
-
-        self.canvas_widget = canvas_widget
-        self.canvas_widget.pack(fill=tk.BOTH, expand=True)
-        self.canvas_widget.configure(background="white")
+        if not ax.lines:
+            ax.plot([], [])
+            ax.set_xlabel("Battle Number")
+            ax.grid(True)
+            # zooming or panning with the toolbar re-buckets the visible range
+            ax.callbacks.connect("xlim_changed", self.on_statistic_zoom)
+        line = ax.lines[0]
+        line.set_color(color)
+        line.set_label(selected_char)
+        ax.set_title(f"{selected_char}: {selected_stat} Over Battles")
+        ax.set_ylabel(selected_stat)
+
+        self.stat_series = None
+        if len(char_data):
+            ax.set_xlim(-0.5, len(char_data) - 0.5)
+            low, high = float(char_data.min()), float(char_data.max())
+            margin = (high - low) * 0.05 or 1
+            ax.set_ylim(low - margin, high + margin)
+        self.stat_series = char_data
+        self.draw_statistic_series(ax, 0, len(char_data))
+        ax.legend()
+        canvas.draw_idle()
+
+    def draw_statistic_series(self, ax, start, stop):
+        line = ax.lines[0]
+        x, mean, low, high = downsample(self.stat_series, start, stop, max(1, int(ax.bbox.width)))
+        line.set_data(x, mean)
+        line.set_marker('o' if low is None else '')
+        if self.stat_band is not None:
+            self.stat_band.remove()
+            self.stat_band = None
+        if low is not None:
+            self.stat_band = ax.fill_between(x, low, high, color=line.get_color(), alpha=0.3, linewidth=0)
+
+    def on_statistic_zoom(self, ax):
+        if self.stat_series is None:
+            return
+        left, right = ax.get_xlim()
+        self.draw_statistic_series(ax, math.floor(left), math.ceil(right) + 1)
+        self.canvases["Statistic"][1].draw_idle()
 
     def update_moveset_graph(self, selected_char):
-        plt.figure(figsize=(6, 4))
-        moveset_data = self.df[self.df["Name"] == selected_char]
-        all_moves = []
-        for moveset_str in moveset_data["Movesets"]:
-            try:
-                moveset = ast.literal_eval(moveset_str)
-                all_moves.extend(moveset)
-            except (ValueError, SyntaxError) as e:
-                print(f"Error parsing moveset string: {moveset_str}. Skipping. Error: {e}")
-                continue
-
-        move_counts = pd.Series(all_moves).value_counts()
-        move_types = move_counts.index.tolist()
-        counts = move_counts.tolist()
+        ax, canvas = self.graph_canvas("Moveset", self.moveset_graph_frame, figsize=(6, 4))
+        move_counts = self.graph_cache.get((selected_char, None, "Moveset"),
+                                           lambda: self.aggregates.move_frequencies(selected_char))
+        move_types = [move for move, _ in move_counts]
+        counts = [count for _, count in move_counts]
         color = self.char_colors.get(selected_char, 'gray')
 
-        plt.bar(move_types, counts, color=color, label=selected_char)
-        plt.title(f"{selected_char} Moveset Distribution")
-        plt.xlabel("Move Type")
-        plt.ylabel("Frequency")
-        plt.grid(axis='y')
-        plt.legend()
-
-        canvas_moveset = FigureCanvasTkAgg(plt.gcf(), master=self.moveset_graph_frame)
-        canvas_moveset.draw()
-        canvas_moveset_widget = canvas_moveset.get_tk_widget()
-
-        if self.canvas_moveset_widget:
-            self.canvas_moveset_widget.destroy()
-
-        self.canvas_moveset_widget = canvas_moveset_widget
-        self.canvas_moveset_widget.pack(fill=tk.BOTH, expand=True)
-        self.canvas_moveset_widget.configure(background="white")
+        bars = ax.patches
+        if len(bars) == len(counts):
+            # same number of moves: move the existing bars instead of rebuilding them
+            for bar, count in zip(bars, counts):
+                bar.set_height(count)
+                bar.set_color(color)
+            ax.set_xticks(range(len(move_types)), move_types)
+            ax.containers[0].set_label(selected_char)
+            ax.relim()
+            ax.autoscale_view()
+        else:
+            ax.clear()
+            ax.bar(move_types, counts, color=color, label=selected_char)
+            ax.set_xlabel("Move Type")
+            ax.set_ylabel("Frequency")
+            ax.grid(axis='y')
+        ax.set_title(f"{selected_char} Moveset Distribution")
+        ax.legend()
+        canvas.draw_idle()
 
     def update_enemy_pie_chart(self, selected_char):
-        plt.figure(figsize=(6, 4))
-        enemy_data = self.df[self.df["Name"] == selected_char]
-        enemy_names = []
-        for name in enemy_data["Name"]:
-            if name == "Meepo":
-                enemy_names.append("Visor")
-                enemy_names.append("Dunky")
-            elif name != "Meepo":
-                enemy_names.append("Meepo")
-        enemy_counts = pd.Series(enemy_names).value_counts()
-        labels = enemy_counts.index.tolist()
-        counts = enemy_counts.tolist()
+        ax, canvas = self.graph_canvas("Enemy", self.enemy_graph_frame, figsize=(6, 4))
+        enemy_counts = self.graph_cache.get((selected_char, None, "Enemy"),
+                                            lambda: self.aggregates.opponent_frequencies(selected_char))
+        labels = [name for name, _ in enemy_counts]
+        counts = [count for _, count in enemy_counts]
         colors = [self.char_colors.get(label, 'gray') for label in labels]
 
-        plt.pie(counts, labels=labels, autopct='%1.1f%%', startangle=90, colors=colors)
-        plt.title(f"{selected_char} Enemy Encounters")
-        plt.legend()
-
-        canvas_enemy = FigureCanvasTkAgg(plt.gcf(), master=self.enemy_graph_frame)
-        canvas_enemy.draw()
-        canvas_enemy_widget = canvas_enemy.get_tk_widget()
-
-        if self.canvas_enemy_widget:
-            self.canvas_enemy_widget.destroy()
-
-        self.canvas_enemy_widget = canvas_enemy_widget
-        self.canvas_enemy_widget.pack(fill=tk.BOTH, expand=True)
-        self.canvas_enemy_widget.configure(background="white")
-
-    def update_table_view(self, selected_char):
-        for widget in self.table_frame.winfo_children():
-            widget.destroy()
-
-        moveset_data = self.df[self.df["Name"] == selected_char]
-        all_moves = []
-        for moveset_str in moveset_data["Movesets"]:
-            try:
-                moveset = ast.literal_eval(moveset_str)
-                all_moves.extend(moveset)
-            except (ValueError, SyntaxError) as e:
-                print(f"Error parsing moveset string: {moveset_str}. Skipping. Error: {e}")
-                continue
-
-        move_counts = pd.Series(all_moves).value_counts().reset_index()
-        move_counts.columns = ["Move", "Frequency"]
+        # wedge geometry depends on every count, so the pie is redrawn on the same axes
+        ax.clear()
+        ax.pie(counts, labels=labels, autopct='%1.1f%%', startangle=90, colors=colors)
+        ax.set_title(f"{selected_char} Enemy Encounters")
+        ax.legend()
+        canvas.draw_idle()
 
+    def build_table(self):
         style = ttk.Style()
         style.theme_use("default")
         style.configure("Treeview",
@@ -250,27 +398,61 @@ class StatisticWindow(tk.Tk):
         table.tag_configure('oddrow', background="#ffffff")
         table.tag_configure('highlight', background="#ffdf80", font=('Segoe UI', 12, 'bold'))
 
-        for index, row in move_counts.iterrows():
-            tag = 'evenrow' if index % 2 == 0 else 'oddrow'
-            table.insert("", "end", values=(row["Move"], row["Frequency"]), tags=(tag,))
-
-        table.insert("", "end", values=("", ""))
-
-        top_move = move_counts.iloc[0]
-        table.insert("", "end",
-                     values=(f"Most Used: {top_move['Move']}", top_move["Frequency"]),
-                     tags=("highlight",))
-
         scrollbar = ttk.Scrollbar(self.table_frame, orient="vertical", command=table.yview)
         table.configure(yscrollcommand=scrollbar.set)
 
         table.pack(side="left", fill="both", expand=True, padx=20, pady=10)
         scrollbar.pack(side="right", fill="y", pady=10)
+        return table
+
+    def update_table_view(self, selected_char):
+        ready = self.aggregates.moves_table_ready()
+        if ready:
+            move_counts = self.graph_cache.get((selected_char, None, "Table"),
+                                               lambda: self.aggregates.table_frequencies(selected_char))
+        else:
+            # the moves table takes a pass over the whole live log: it is built on a
+            # worker the first time this view is shown and drawn once it is there
+            if self.moves_table_thread is None:
+                self.moves_table_thread = threading.Thread(target=self.aggregates.build_moves_table, daemon=True)
+                self.moves_table_thread.start()
+                self.after(LOAD_POLL_MS, self.check_moves_table)
+            move_counts = [("Loading moves...", "")]
+        table = self.table
+        table.delete(*table.get_children())
+
+        for index, (move, frequency) in enumerate(move_counts):
+            tag = 'evenrow' if index % 2 == 0 else 'oddrow'
+            table.insert("", "end", values=(move, frequency), tags=(tag,))
+
+        table.insert("", "end", values=("", ""))
+
+        if move_counts and ready:
+            top_move, top_frequency = move_counts[0]
+            table.insert("", "end",
+                         values=(f"Most Used: {top_move}", top_frequency),
+                         tags=("highlight",))
+
+    def check_moves_table(self):
+        if self.moves_table_thread.is_alive():
+            self.after(LOAD_POLL_MS, self.check_moves_table)
+            return
+        # also when the build gave up because the log was reset under it: showing the
+        # view again starts another one
+        self.moves_table_thread = None
+        if self.selected_graph_type.get() == "Table":
+            self.update_graph()
 
     def back_to_main_menu(self):
+        self.load_cancelled.set()
         self.destroy()
 
 
 if __name__ == "__main__":
+    if "--query" in sys.argv:
+        # python statistic.py --query summary --format csv ... runs without opening a window
+        import stats_query
+        stats_query.main([arg for arg in sys.argv[1:] if arg != "--query"])
+        sys.exit(0)
     app = StatisticWindow()
     app.mainloop()
@@ -0,0 +1,216 @@
+import argparse
+import csv
+import json
+import sys
+import numpy as np
+import combat_log
+import log_aggregates
+from log_aggregates import FIELDS, RESULT_NAMES, RESULT_SLOTS
+
+# Headless version of the numbers statistic.py shows, for batch jobs on simulator logs.
+# The log is streamed in fixed-size chunks into fixed-size accumulators (one row per
+# name code), so memory does not depend on the log size. The per-battle series is
+# written out chunk by chunk as well instead of being collected. Like the Statistic
+# window, the totals start from the history snapshot of compacted segments (pruned or
+# not) and then read the segments it does not cover yet and the live log. The history
+# keeps each character's per-battle stats but not the battle ids, opponents or results
+# that go with them, so the series query only covers records still on disk.
+
+QUERIES = ["summary", "moves", "opponents", "series"]
+
+
+class StreamingStats:
+    def __init__(self):
+        self.battles = np.zeros(256, dtype=np.int64)
+        self.totals = np.zeros((256, len(FIELDS)), dtype=np.int64)
+        self.lows = np.full((256, len(FIELDS)), np.iinfo(np.int64).max, dtype=np.int64)
+        self.highs = np.full((256, len(FIELDS)), np.iinfo(np.int64).min, dtype=np.int64)
+        self.move_counts = np.zeros((256, 256), dtype=np.int64)
+        self.results = np.zeros((256, 256, len(RESULT_NAMES)), dtype=np.int64)
+
+    def add(self, records, moves):
+        names = records["name"].astype(np.intp)
+        values = np.stack([records[field].astype(np.int64) for field in FIELDS], axis=1)
+        self.battles += np.bincount(names, minlength=256)
+        np.add.at(self.totals, names, values)
+        np.minimum.at(self.lows, names, values)
+        np.maximum.at(self.highs, names, values)
+        np.add.at(self.results, (names, records["opponent"], RESULT_SLOTS[records["result"]]), 1)
+        record_index, _, move_codes = combat_log.explode_moves(records, moves)
+        np.add.at(self.move_counts, (names[record_index], move_codes), 1)
+
+    def add_history(self, history, header):
+        """Adds a CombatAggregates history snapshot, mapping its codes onto header's."""
+        names = codes_in(header["names"], history.names[:len(history.battles)])
+        moves = codes_in(header["moves"], history.moves)
+        self.battles[names] += history.battles
+        self.totals[names] += history.totals
+        self.move_counts[names[:, None], moves[None, :]] += (history.history_move_counts
+                                                             + history.live_move_counts)[:, :len(moves)]
+        self.results[names[:, None], names[None, :]] += history.results[:, :len(names)]
+        self.lows[names] = np.minimum(self.lows[names], history.lows)
+        self.highs[names] = np.maximum(self.highs[names], history.highs)
+
+    def summary(self, header):
+        rows = []
+        for code, name in enumerate(header["names"]):
+            count = int(self.battles[code])
+            if not count:
+                continue
+            row = {"name": name, "battles": count}
+            for slot, result in enumerate(RESULT_NAMES):
+                row[result] = int(self.results[code, :, slot].sum())
+            for i, field in enumerate(FIELDS):
+                row[f"{field}_total"] = int(self.totals[code, i])
+                row[f"{field}_mean"] = round(self.totals[code, i] / count, 3)
+                row[f"{field}_min"] = int(self.lows[code, i])
+                row[f"{field}_max"] = int(self.highs[code, i])
+            rows.append(row)
+        return rows
+
+    def moves(self, header):
+        rows = []
+        for code, name in enumerate(header["names"]):
+            counts = self.move_counts[code]
+            for move in np.argsort(-counts[:len(header["moves"])], kind="stable"):
+                if counts[move]:
+                    rows.append({"name": name, "move": header["moves"][move], "count": int(counts[move])})
+        return rows
+
+    def opponents(self, header):
+        rows = []
+        names = header["names"]
+        for code, name in enumerate(names):
+            for opponent, opponent_name in enumerate(names):
+                counts = self.results[code, opponent]
+                if counts.any():
+                    row = {"name": name, "opponent": opponent_name, "battles": int(counts.sum())}
+                    row.update({result: int(counts[slot]) for slot, result in enumerate(RESULT_NAMES)})
+                    rows.append(row)
+        return rows
+
+
+def codes_in(table, values):
+    """Codes of values in table (a header's name or move table), appending new ones."""
+    for value in values:
+        if value not in table:
+            table.append(value)
+    return np.array([table.index(value) for value in values], dtype=np.intp)
+
+
+def load_history(path):
+    """The history snapshot of the log's compacted segments, or None."""
+    history = log_aggregates.CombatAggregates(path, path=log_aggregates.history_path(path), history=False)
+    return history if history.load() else None
+
+
+def pruned_battles(path, history):
+    """Battles the history covers whose segments are no longer on disk."""
+    if history is None:
+        return 0
+    on_disk = sum(combat_log.record_count(segment) // 2 for first_id, segment in combat_log.list_segments(path)
+                  if first_id < history.first_battle_id)
+    return int(history.battles.sum()) // 2 - on_disk
+
+
+def chunks(path, count, chunk_records, first_battle_id=0):
+    """(records, moves) chunks of the segments from first_battle_id on and then the live
+    log's first count records."""
+    segments = [segment for first_id, segment in combat_log.list_segments(path) if first_id >= first_battle_id]
+    for log_file in segments + [path]:
+        moves = combat_log.open_moves(log_file)
+        total = count if log_file == path else combat_log.record_count(log_file)
+        for begin in range(0, total, chunk_records):
+            yield combat_log.open_records(log_file, begin, min(total, begin + chunk_records)), moves
+
+
+def series_rows(header, records, name_code=None):
+    if name_code is not None:
+        records = records[records["name"] == name_code]
+    names = header["names"] + [""]
+    for record in records:
+        row = {"battle": int(record["battle_id"]), "name": names[record["name"]],
+               "opponent": names[record["opponent"]],
+               "result": combat_log.RESULTS.get(int(record["result"]), "Unknown")}
+        row.update({field: int(record[field]) for field in FIELDS})
+        yield row
+
+
+class RowWriter:
+    """CSV with a header row, or JSON; streamed rows are written as JSON Lines."""
+
+    def __init__(self, out, fmt):
+        self.out = out
+        self.fmt = fmt
+        self.csv_writer = None
+
+    def write(self, rows):
+        for row in rows:
+            if self.fmt == "csv":
+                if self.csv_writer is None:
+                    self.csv_writer = csv.DictWriter(self.out, fieldnames=list(row.keys()), lineterminator="\n")
+                    self.csv_writer.writeheader()
+                self.csv_writer.writerow(row)
+            else:
+                self.out.write(json.dumps(row) + "\n")
+
+    def write_all(self, rows):
+        if self.fmt == "json":
+            json.dump(rows, self.out, indent=2)
+            self.out.write("\n")
+        else:
+            self.write(rows)
+
+
+def run_query(query, path=combat_log.LOG_FILE, fmt="json", out=sys.stdout, name=None, chunk_records=1 << 16):
+    header, count = combat_log.snapshot(path)
+    history = load_history(path)
+    first_battle_id = history.first_battle_id if history else 0
+    if query == "series":
+        writer = RowWriter(out, fmt)
+        name_code = None
+        if name is not None:
+            if name not in header["names"]:
+                raise ValueError(f"{name!r} is not in {path}")
+            name_code = header["names"].index(name)
+        pruned = pruned_battles(path, history)
+        if pruned:
+            print(f"note: {pruned} battles only survive in {history.path}, which keeps their stats but "
+                  f"not their battle ids, opponents or results; they are not in the series", file=sys.stderr)
+        for records, _ in chunks(path, count, chunk_records):
+            writer.write(series_rows(header, records, name_code))
+        return
+
+    stats = StreamingStats()
+    if history is not None:
+        stats.add_history(history, header)
+    for records, moves in chunks(path, count, chunk_records, first_battle_id):
+        stats.add(records, moves)
+    rows = getattr(stats, query)(header)
+    if name is not None:
+        rows = [row for row in rows if row["name"] == name]
+    RowWriter(out, fmt).write_all(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Combat log statistics without the GUI.")
+    parser.add_argument("query", choices=QUERIES,
+                        help="summary: per-character stats and results; moves: move frequencies; "
+                             "opponents: results by opponent; series: one row per character per battle")
+    parser.add_argument("--log", default=combat_log.LOG_FILE)
+    parser.add_argument("--format", choices=["json", "csv"], default="json",
+                        help="series in json is written as JSON Lines")
+    parser.add_argument("--name", help="only this character")
+    parser.add_argument("--out", help="output file, defaults to stdout")
+    parser.add_argument("--chunk", type=int, default=1 << 16, help="records read per chunk")
+    args = parser.parse_args(argv)
+    out = open(args.out, "w", newline="") if args.out else sys.stdout
+    try:
+        run_query(args.query, args.log, args.format, out, args.name, args.chunk)
+    finally:
+        if args.out:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
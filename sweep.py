@@ -0,0 +1,112 @@
+import argparse
+import csv
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import attribute as atr
+from batch_sim import BatchBattle
+
+CHARACTERS = {
+    "meepo": atr.meepo_attributes,
+    "visor": atr.visor_attributes,
+    "dunky": atr.dunky_attributes
+}
+STAT_FIELDS = ["health", "mana", "strength", "defense"]
+
+
+def parse_range(text):
+    """'name.field=start:stop[:step]' with an inclusive stop, or a comma list of values."""
+    key, _, spec = text.partition("=")
+    char, _, field = key.partition(".")
+    if char not in CHARACTERS or field not in STAT_FIELDS:
+        raise argparse.ArgumentTypeError(f"expected one of {list(CHARACTERS)} . {STAT_FIELDS}, got {key!r}")
+    if ":" in spec:
+        parts = [int(p) for p in spec.split(":")]
+        start, stop = parts[0], parts[1]
+        step = parts[2] if len(parts) > 2 else 1
+        values = list(range(start, stop + 1, step))
+    else:
+        values = [int(p) for p in spec.split(",")]
+    if not values:
+        raise argparse.ArgumentTypeError(f"empty range for {key}")
+    return key, values
+
+
+def build_attributes(overrides):
+    attrs = {name: dict(attr) for name, attr in CHARACTERS.items()}
+    for key, value in overrides.items():
+        char, field = key.split(".")
+        attrs[char][field] = value
+    return attrs
+
+
+def run_cell(task):
+    # The seed belongs to the cell, not to the worker, so the grid comes out the
+    # same whatever the pool size or scheduling order.
+    overrides, hero, enemy, battles, seed, chunk = task
+    attrs = build_attributes(overrides)
+    rng = np.random.default_rng(seed)
+    wins = draws = turns = 0
+    done = 0
+    while done < battles:
+        n = min(chunk, battles - done)
+        batch = BatchBattle(attrs[hero], attrs[enemy], n).run(rng)
+        wins += int((batch.winner == 0).sum())
+        draws += int((batch.winner == -1).sum())
+        turns += int(batch.turns.sum())
+        done += n
+    return {
+        "win_rate": wins / battles,
+        "draw_rate": draws / battles,
+        "avg_turns": turns / battles
+    }
+
+
+def sweep(ranges, hero="meepo", enemies=("visor", "dunky"), battles=10000, workers=None,
+          seed=0, chunk=100000):
+    keys = [key for key, _ in ranges]
+    cells = [dict(zip(keys, values)) for values in itertools.product(*[v for _, v in ranges])]
+    tasks = [(cell, hero, enemy) for cell in cells for enemy in enemies]
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    jobs = [(cell, hero, enemy, battles, child, chunk) for (cell, hero, enemy), child in zip(tasks, seeds)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(run_cell, jobs, chunksize=max(1, len(jobs) // (4 * (workers or os.cpu_count() or 1)))))
+
+    rows = []
+    for (cell, hero, enemy), result in zip(tasks, results):
+        row = dict(cell)
+        row.update({"hero": hero, "enemy": enemy, "battles": battles})
+        row.update(result)
+        rows.append(row)
+    return rows
+
+
+def write_grid(rows, filename):
+    with open(filename, mode="w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Win-rate / average-turns grid over character stats.")
+    parser.add_argument("--vary", action="append", type=parse_range, default=[],
+                        help="e.g. meepo.strength=10:30:5 or visor.health=120,150,180 (repeatable)")
+    parser.add_argument("--hero", default="meepo", choices=list(CHARACTERS))
+    parser.add_argument("--enemy", action="append", choices=list(CHARACTERS),
+                        help="enemy to fight (repeatable), defaults to visor and dunky")
+    parser.add_argument("--battles", type=int, default=10000, help="battles per cell")
+    parser.add_argument("--workers", type=int, default=None, help="process count, defaults to all cores")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="sweep.csv")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = sweep(args.vary, args.hero, args.enemy or ["visor", "dunky"], args.battles, args.workers, args.seed)
+    elapsed = time.perf_counter() - start
+    write_grid(rows, args.out)
+    total = len(rows) * args.battles
+    print(f"{len(rows)} cells, {total} battles in {elapsed:.2f}s ({total / elapsed:.0f} battles/s) -> {args.out}")
@@ -0,0 +1,8 @@
+import pytest
+import attribute as atr
+from batch_sim import parity_check
+
+
+@pytest.mark.parametrize("enemy", [atr.visor_attributes, atr.dunky_attributes], ids=lambda attr: attr["name"])
+def test_batch_matches_scalar_engine(enemy):
+    assert parity_check(atr.meepo_attributes, enemy, n=300, seed=7) == []
@@ -0,0 +1,77 @@
+import random
+import numpy as np
+import pytest
+import attribute as atr
+import combat_log
+import log_aggregates
+from battle_engine import simulate_battle
+
+
+def battles(count, seed=0):
+    rng = random.Random(seed)
+    return [simulate_battle(atr.meepo_attributes, atr.visor_attributes if i % 2 == 0 else atr.dunky_attributes,
+                            rng).combat_log_entries() for i in range(count)]
+
+
+def test_torn_tail_is_dropped_before_the_next_append(tmp_path):
+    log = str(tmp_path / "combat_log.bin")
+    combat_log.append_battles(log, battles(3))
+    first, _ = battles(1, seed=1)[0]
+    header = combat_log.read_header(log)
+    # a writer that died after one record of a battle, and another halfway through a record
+    record, _ = combat_log.pack_battle(header, 3, 0, [first])
+    with open(log, "ab") as file:
+        file.write(record + record[:combat_log.RECORD_SIZE // 2])
+    assert combat_log.verify(log)
+
+    ids = combat_log.append_battles(log, battles(2, seed=2))
+    assert ids == [3, 4]
+    assert combat_log.verify(log) == []
+    assert combat_log.record_count(log) == 10
+
+
+@pytest.mark.parametrize("prune", [False, True])
+def test_aggregates_match_a_recount_across_rotations(tmp_path, prune):
+    log = str(tmp_path / "combat_log.bin")
+    aggregates = log_aggregates.CombatAggregates(log)
+    played = []
+    for batch in range(8):
+        pending = battles(7, seed=batch)
+        combat_log.append_battles(log, pending, rotate_records=40)
+        played += pending
+        if prune:
+            log_aggregates.compact_history(log, prune=True)
+        aggregates.refresh()
+    assert len(combat_log.list_segments(log)) == (0 if prune else 2)
+
+    for opened in (aggregates, log_aggregates.CombatAggregates(log)):
+        opened.refresh()
+        for name in ("Meepo", "Visor", "Dunky"):
+            entries = [entry for battle in played for entry in battle if entry["name"] == name]
+            code = opened.names.index(name)
+            series = np.array([[entry[field] for field in log_aggregates.FIELDS] for entry in entries])
+            assert opened.battles[code] == len(entries)
+            assert opened.totals[code].tolist() == series.sum(axis=0).tolist()
+            assert opened.lows[code].tolist() == series.min(axis=0).tolist()
+            assert opened.highs[code].tolist() == series.max(axis=0).tolist()
+            assert opened.series_array(code).tolist() == series.tolist()
+            moves = {}
+            for entry in entries:
+                for move in entry["moves"]:
+                    moves[move] = moves.get(move, 0) + 1
+            assert dict(opened.move_frequencies(name)) == moves
+
+
+def test_legacy_csv_is_merged_once(tmp_path):
+    csv_path = tmp_path / "combat_log.csv"
+    csv_path.write_text("Name,Damage Dealt,Healing Done,Damage Mitigated,Movesets\n"
+                        "Meepo,10,0,2,\"['attack', 'Heal']\"\nVisor,7,0,0,['defend']\n\n"
+                        "Meepo,1,0,0,[]\n\n"
+                        "Meepo,3,1,0,[]\nVisor,4,0,0,[]\n")
+    log = str(tmp_path / "combat_log.bin")
+    # the first battle creates the log; the CSV still goes in ahead of it
+    assert combat_log.append_battles(log, battles(1)) == [2]
+    assert combat_log.migrate_csv(log) == (0, 0)
+    assert combat_log.record_count(log) == 6
+    assert combat_log.verify(log) == []
+    assert combat_log.convert_csv(str(csv_path), str(tmp_path / "converted.bin")) == (2, 1)
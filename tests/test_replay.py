@@ -0,0 +1,17 @@
+import attribute as atr
+import replay
+
+
+def test_recorded_battles_replay_the_same(tmp_path):
+    path = str(tmp_path / "combat_replays.jsonl")
+    records = [replay.recording(replay.play_recorded(atr.meepo_attributes, enemy, seed), atr.meepo_attributes, enemy)
+               for seed, enemy in enumerate([atr.visor_attributes, atr.dunky_attributes] * 3)]
+    replay.save_replays(path, records)
+
+    loaded = list(replay.load_replays(path))
+    assert len(loaded) == 6
+    assert [replay.verify(record) for record in loaded] == [[]] * 6
+
+    # and a battle that did not play out as recorded is caught
+    loaded[0]["final"]["turns"] += 1
+    assert replay.verify(loaded[0])